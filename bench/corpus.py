@@ -0,0 +1,145 @@
+"""
+Synthetic ECO mail corpus as raw RFC822 bytes.
+
+Usage:
+    python bench/corpus.py --size 1000 --out corpus_dir
+"""
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+from email import policy
+from email.message import EmailMessage
+from email.utils import format_datetime
+from typing import Dict, List
+
+# Share of each kind of mail in a generated corpus
+DEFAULT_MIX = {
+    "plain": 0.35,
+    "html": 0.35,
+    "other": 0.2,
+    "attachment": 0.1,
+}
+
+# Encoded headers use RFC 2047 words, unencoded ones raw UTF-8 (SMTPUTF8)
+ENCODED_POLICY = policy.SMTP
+UNENCODED_POLICY = policy.SMTPUTF8.clone(linesep="\r\n")
+
+PRODUCTS = ["智能网关", "工业控制器", "电源模块", "通讯板卡", "传感器套件"]
+ORGANIZERS = ["张三", "李四", "王五", "赵六"]
+
+
+def eco_fields(i: int) -> Dict[str, str]:
+    return {
+        "ecn编码": f"ECN{i:06d}",
+        "ecn名称": f"{PRODUCTS[i % len(PRODUCTS)]}物料变更 {i}",
+        "产品名称": PRODUCTS[i % len(PRODUCTS)],
+        "工作负责人": ORGANIZERS[i % len(ORGANIZERS)],
+    }
+
+
+def plain_body(fields: Dict[str, str]) -> str:
+    lines = ["您好，", "以下ECO审批流程已完成，请及时导入：", ""]
+    lines += [f"{label}：{value}" for label, value in fields.items()]
+    lines += ["", "此邮件由系统自动发送，请勿回复。"]
+    return "\n".join(lines) + "\n"
+
+
+def html_body(fields: Dict[str, str], filler_rows: int = 30) -> str:
+    """Table-based approval mail like the ones sent by the workflow system."""
+    rows = "".join(
+        f"<tr><td class=\"label\">{label}：</td><td class=\"value\">{value}</td></tr>"
+        for label, value in fields.items()
+    )
+    filler = "".join(
+        f"<tr><td>审批节点{n}</td><td>已通过 &amp; 已归档</td><td>{n:02d}:00</td></tr>"
+        for n in range(filler_rows)
+    )
+    return (
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+        "<style>td{border:1px solid #ccc;padding:4px}.label{font-weight:bold}</style>"
+        "<script>var tracking = '<b>ignored</b>';</script></head><body>"
+        "<!-- workflow template v3 -->"
+        "<p>您好，</p><p>以下ECO审批流程已完成，请及时导入：</p>"
+        f"<table>{rows}</table><br><table>{filler}</table>"
+        "<p>此邮件由系统自动发送，请勿回复。</p></body></html>"
+    )
+
+
+def build_mail(
+    i: int,
+    kind: str = "plain",
+    encoded_headers: bool = True,
+    attachment_size: int = 512 * 1024,
+    days_ago: int = 2,
+) -> bytes:
+    """One raw mail; kind is one of DEFAULT_MIX's keys."""
+    msg = EmailMessage()
+    fields = eco_fields(i)
+    if kind == "other":
+        msg["Subject"] = f"周报汇总 第{i}期"
+    else:
+        msg["Subject"] = f"ECO审批流程 {fields['ecn编码']} 待导入"
+    msg["From"] = "工作流系统 <workflow@example.com>"
+    msg["To"] = "eco@example.com"
+    msg["Date"] = format_datetime((datetime.now() - timedelta(days=days_ago, minutes=i)).astimezone())
+    msg["Message-ID"] = f"<bench-{i}@example.com>"
+
+    if kind == "html":
+        msg.set_content(html_body(fields), subtype="html")
+    elif kind == "other":
+        msg.set_content("本周各项目进展见附件。\n")
+    else:
+        msg.set_content(plain_body(fields))
+
+    if kind == "attachment":
+        msg.add_attachment(
+            random.Random(i).randbytes(attachment_size),
+            maintype="application",
+            subtype="pdf",
+            filename="ECO变更单.pdf",
+        )
+
+    return msg.as_bytes(policy=ENCODED_POLICY if encoded_headers else UNENCODED_POLICY)
+
+
+def generate(
+    size: int,
+    seed: int = 0,
+    mix: Dict[str, float] | None = None,
+    encoded_ratio: float = 0.5,
+    attachment_size: int = 512 * 1024,
+) -> List[bytes]:
+    """Generate `size` raw mails, deterministic for a given seed."""
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    return [
+        build_mail(
+            i,
+            kind=rng.choices(kinds, weights)[0],
+            encoded_headers=rng.random() < encoded_ratio,
+            attachment_size=attachment_size,
+        )
+        for i in range(size)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic ECO mail corpus (.eml files).")
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--attachment-size", type=int, default=512 * 1024)
+    parser.add_argument("--out", default="corpus")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    for i, raw in enumerate(generate(args.size, seed=args.seed, attachment_size=args.attachment_size)):
+        with open(os.path.join(args.out, f"{i:06d}.eml"), "wb") as f:
+            f.write(raw)
+    print(f"已生成{args.size}封邮件: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
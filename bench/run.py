@@ -0,0 +1,201 @@
+"""
+Throughput and peak-memory benchmark for the mail pipeline stages.
+
+Usage:
+    python bench/run.py --sizes 100 1000 --out bench_results.json
+
+Runs offline: credentials fall back to dummy values and all config/state
+files live in a temporary directory.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus
+
+
+def prepare_env(work_dir: str):
+    """Dummy credentials and a recipients config, so mapping imports without a .env."""
+    os.environ.setdefault("ECO_MAIL_ADDRESS", "bench@example.com")
+    os.environ.setdefault("ECO_MAIL_PASSWORD", "bench")
+    os.environ.setdefault("DINGTALK_CLIENT_ID", "bench")
+    os.environ.setdefault("DINGTALK_CLIENT_SECRET", "bench")
+
+    config_dir = os.path.join(work_dir, "config")
+    os.makedirs(config_dir, exist_ok=True)
+    with open(os.path.join(config_dir, "dingtalk_recipients.json"), "w", encoding="utf-8") as f:
+        json.dump({"eco_todo_user_ids": ["bench_user"], "error_todo_user_ids": ["bench_admin"]}, f)
+    eco_fields = os.path.join(REPO_DIR, "config", "eco_fields.json")
+    if os.path.exists(eco_fields):
+        shutil.copy(eco_fields, config_dir)
+    os.chdir(work_dir)
+
+
+def measure(fn: Callable, items: List) -> Dict:
+    """Time fn over items, then repeat under tracemalloc for the peak."""
+    started = time.perf_counter()
+    for item in items:
+        fn(item)
+    seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    for item in items:
+        fn(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "msgs": len(items),
+        "seconds": round(seconds, 6),
+        "msgs_per_sec": round(len(items) / seconds, 1) if seconds else None,
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def measure_once(fn: Callable[[], object], count: int) -> Dict:
+    """Like measure() for a single call covering `count` records."""
+    started = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "msgs": count,
+        "seconds": round(seconds, 6),
+        "msgs_per_sec": round(count / seconds, 1) if seconds else None,
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def html_parity(raw_emails: Iterable[bytes]) -> Dict[str, bool]:
+    """Every HTML backend must extract the same fields as BeautifulSoup."""
+    from mapping import mapping
+    import htmltext
+    import mailparser
+
+    msgs = [mailparser.mail_parser(raw) for raw in raw_emails]
+    results = {}
+    original = mapping.html_backend
+    try:
+        expected = []
+        mapping.html_backend = "bs4"
+        for msg in msgs:
+            expected.append(mailparser.extract_useful_parts(msg))
+        for backend in htmltext.BACKENDS:
+            if backend == "lxml":
+                try:
+                    import lxml.html  # noqa: F401
+                except ImportError:
+                    continue
+            mapping.html_backend = backend
+            results[backend] = all(
+                mailparser.extract_useful_parts(msg) == fields
+                for msg, fields in zip(msgs, expected)
+            )
+    finally:
+        mapping.html_backend = original
+    return results
+
+
+def run_size(size: int, seed: int, attachment_size: int, state_dir: str) -> Dict:
+    from mapping import mapping
+    import mailparser
+    import state
+
+    # Fresh, empty state per corpus so every ECO mail passes the filter
+    mapping.json_fn = os.path.join(state_dir, f"processed_{size}.json")
+    mapping.json_journal_fn = os.path.join(state_dir, f"processed_{size}.journal")
+    state._processed_stores.clear()
+
+    raw_emails = corpus.generate(size, seed=seed, attachment_size=attachment_size)
+    msgs = [mailparser.mail_parser(raw) for raw in raw_emails]
+    matching = [msg for msg in msgs if mailparser.mail_filter(msg) is not None]
+
+    results = {
+        "corpus_bytes": sum(len(raw) for raw in raw_emails),
+        "matching": len(matching),
+        "mail_parser": measure(mailparser.mail_parser, raw_emails),
+        "filter_headers": measure(mailparser.filter_headers, raw_emails),
+        "mail_filter": measure(mailparser.mail_filter, msgs),
+        "extract_useful_parts": measure(mailparser.extract_useful_parts, matching),
+    }
+
+    # State load/save with one processed entry per mail
+    now = datetime.now().strftime(mapping.json_time_format)
+    store = state.ProcessedStore({f"<bench-{i}@example.com>": now for i in range(size)})
+    results["state_save"] = measure_once(store.save, size)
+    results["state_load"] = measure_once(state.load_state, size)
+
+    html_emails = [raw for raw in raw_emails if b"text/html" in raw][:50]
+    results["html_parity"] = html_parity(html_emails)
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mail_parser, mail_filter, extract_useful_parts and state.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--attachment-size", type=int, default=512 * 1024)
+    parser.add_argument("--out", default="bench_results.json")
+    args = parser.parse_args()
+    out = os.path.abspath(args.out)
+
+    with tempfile.TemporaryDirectory(prefix="eco-bench-") as work_dir:
+        prepare_env(work_dir)
+        from mapping import mapping
+
+        report = {
+            "revision": git_revision(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "html_backend": mapping.html_backend,
+            "seed": args.seed,
+            "results": {},
+        }
+        for size in args.sizes:
+            print(f"测试{size}封邮件...")
+            report["results"][str(size)] = run_size(size, args.seed, args.attachment_size, work_dir)
+        os.chdir(REPO_DIR)
+
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入: {out}")
+
+    for size, results in report["results"].items():
+        for stage, numbers in results.items():
+            if isinstance(numbers, dict) and "msgs_per_sec" in numbers:
+                print(f"{size:>6} {stage:<22} {numbers['msgs_per_sec']:>10} msgs/s {numbers['peak_kb']:>10} KB")
+        if not all(results["html_parity"].values()):
+            print(f"HTML后端结果不一致: {results['html_parity']}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Import-time budget for the cron path that finds no new mail.
+
+Usage:
+    python bench/startup.py --repeat 5 --budget-ms 150
+
+Runs main.run_once() in a child process under `python -X importtime`
+against an empty local IMAP mailbox (loadtest/fake_imap.py), with the unionId
+cache pre-filled as on a warm cron host. Reports the import time of every
+module loaded during the run and fails if it exceeds the budget or if
+requests, the alibabacloud SDKs or BeautifulSoup were imported at all.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "loadtest"))
+
+import fake_imap
+
+# Packages a run without new mail must not import
+HEAVY_PACKAGES = {"requests", "urllib3", "alibabacloud_dingtalk", "alibabacloud_tea_openapi", "Tea", "aiohttp", "bs4"}
+
+
+def parse_importtime(stderr: str) -> Tuple[List[Tuple[str, int]], List[str]]:
+    """
+    Top-level imports after interpreter startup as (module, cumulative µs),
+    and every imported module of a heavy package.
+    """
+    top_level: List[Tuple[str, int]] = []
+    heavy = []
+    started = False
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        module = name.strip()
+        if module.split(".")[0] in HEAVY_PACKAGES:
+            heavy.append(module)
+        # Everything up to and including site is interpreter startup
+        if not name.startswith("  "):
+            if started:
+                top_level.append((module, int(cumulative)))
+            elif module == "site":
+                started = True
+    return top_level, heavy
+
+
+def write_config(work_dir: str, user_ids: List[str]):
+    config_dir = os.path.join(work_dir, "config")
+    os.makedirs(config_dir, exist_ok=True)
+    with open(os.path.join(config_dir, "dingtalk_recipients.json"), "w", encoding="utf-8") as f:
+        json.dump({"eco_todo_user_ids": user_ids[:1], "error_todo_user_ids": user_ids[1:]}, f)
+    # A warm host already knows every recipient's unionId
+    expires_at = time.time() + 86400
+    with open(os.path.join(work_dir, "dingtalk_union_ids.json"), "w", encoding="utf-8") as f:
+        json.dump({user_id: {"union_id": f"union-{user_id}", "expires_at": expires_at} for user_id in user_ids}, f)
+
+
+def run_once(port: int) -> Dict:
+    with tempfile.TemporaryDirectory(prefix="eco-startup-") as work_dir:
+        write_config(work_dir, ["startup_user", "startup_admin"])
+        env = dict(
+            os.environ,
+            ECO_MAIL_ADDRESS="startup@example.com",
+            ECO_MAIL_PASSWORD="startup",
+            ECO_IMAP_HOST="127.0.0.1",
+            ECO_IMAP_PORT=str(port),
+            ECO_IMAP_SSL="0",
+            DINGTALK_CLIENT_ID="startup",
+            DINGTALK_CLIENT_SECRET="startup",
+        )
+        command = [sys.executable, "-X", "importtime", os.path.join(REPO_DIR, "loadtest", "run_main.py")]
+        child = subprocess.run(command, cwd=work_dir, env=env, capture_output=True, text=True)
+
+    if child.returncode != 0 or "没有新邮件" not in child.stdout:
+        raise RuntimeError(f"no-new-mail run failed:\n{child.stdout[-2000:]}\n{child.stderr[-2000:]}")
+    timings = json.loads(child.stdout.strip().splitlines()[-1])
+    top_level, heavy = parse_importtime(child.stderr)
+    return {
+        "import_ms": round(sum(us for _, us in top_level) / 1000, 1),
+        "run_seconds": timings["run_seconds"],
+        "top_level": top_level,
+        "heavy": heavy,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time budget of a run without new mail.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=150, help="median import time allowed")
+    parser.add_argument("--top", type=int, default=10, help="slowest top-level imports to list")
+    parser.add_argument("--out", default=None, help="optional JSON report")
+    args = parser.parse_args()
+
+    server = fake_imap.start(fake_imap.Mailbox([]))
+    try:
+        runs = [run_once(server.server_address[1]) for _ in range(args.repeat)]
+    finally:
+        server.shutdown()
+
+    median_ms = statistics.median(run["import_ms"] for run in runs)
+    heavy = sorted({module for run in runs for module in run["heavy"]})
+    slowest = sorted(runs[-1]["top_level"], key=lambda item: item[1], reverse=True)[:args.top]
+
+    print(f"无新邮件运行的导入时间: 中位数 {median_ms} ms (预算 {args.budget_ms} ms), {args.repeat}次")
+    for module, us in slowest:
+        print(f"  {us / 1000:8.1f} ms  {module}")
+    if heavy:
+        print(f"不应导入的重量级模块: {', '.join(heavy)}")
+
+    if args.out:
+        report = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "budget_ms": args.budget_ms,
+            "median_import_ms": median_ms,
+            "runs": [{key: run[key] for key in ("import_ms", "run_seconds")} for run in runs],
+            "slowest": slowest,
+            "heavy": heavy,
+        }
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入: {os.path.abspath(args.out)}")
+
+    if median_ms > args.budget_ms or heavy:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import imaplib
+import threading
+import time
+from functools import partial
+from mapping import mapping
+import mailparser
+import dingtalk
+import state
+import inbox
+import main
+import retry
+import metrics
+import profiling
+import mailboxes
+
+
+def serve(cfg=mapping):
+    """
+    Keep one IMAP session open and run the TODO pipeline as mail arrives.
+    New mail is detected with IDLE (NOOP polling as fallback); the session is
+    re-established with exponential backoff whenever it drops.
+    cfg is mapping or a mailbox profile of the multi-mailbox mode.
+    """
+    name = main.mailbox_name(cfg)
+    checkpoint = state.load_checkpoint(cfg)
+    dingtalk.warm_union_ids(
+        client_id=mapping.client_id,
+        client_secret=mapping.client_secret,
+        user_ids=cfg.DingDing_ids + cfg.error_user_ids,
+    )
+    header_filter = partial(mailparser.header_filter, cfg=cfg) if mapping.imap_two_phase_fetch else None
+    failures = 0
+
+    while True:
+        try:
+            imap = inbox.connect(
+                mail_address=cfg.mail_address,
+                mail_password=cfg.mail_password,
+                imap_host=cfg.imap_host,
+                port=cfg.port,
+            )
+        except Exception as e:
+            delay = retry.backoff_delay(failures, mapping.daemon_reconnect_min_delay, mapping.daemon_reconnect_max_delay)
+            failures += 1
+            print(f"邮箱{name}连接失败, {retry.describe_error(e)}，等待{delay:.1f}秒后重连")
+            time.sleep(delay)
+            continue
+
+        try:
+            while True:
+                # Each wake-up gets its own run time budget
+                retry.run_budget.start(mapping.run_time_budget)
+                # Only UIDs above the checkpoint are fetched
+                attempt_checkpoint = dict(checkpoint)
+                raw_emails = (
+                    raw_email for _, raw_email in inbox.iter_new(imap, attempt_checkpoint, header_filter, cfg=cfg)
+                )
+                try:
+                    # Mailbox threads are profiled per wake-up (--profile)
+                    with profiling.thread_profile():
+                        main.process_emails(raw_emails, cfg)
+                    checkpoint = attempt_checkpoint
+                    state.save_checkpoint(data=checkpoint, cfg=cfg)
+                    metrics.inc("eco_runs_total", mailbox=name, result="ok")
+                    # Only a full cycle proves the session works
+                    failures = 0
+                except main.TodoFailures as e:
+                    # Failed TODOs wait in the outbox, so the checkpoint still advances
+                    checkpoint = attempt_checkpoint
+                    state.save_checkpoint(data=checkpoint, cfg=cfg)
+                    failures = 0
+                    print(f"处理邮件失败({name}): {retry.describe_error(e)}")
+                    metrics.inc("eco_runs_total", mailbox=name, result="failed")
+                    main.send_error_todo(e, cfg)
+                except inbox.CONNECTION_ERRORS:
+                    # Connection problems while streaming: reconnect below
+                    metrics.inc("eco_runs_total", mailbox=name, result="failed")
+                    raise
+                except Exception as e:
+                    # Keep the checkpoint so the mails are retried on the next wake-up
+                    print(f"处理邮件失败({name}): {retry.describe_error(e)}")
+                    metrics.inc("eco_runs_total", mailbox=name, result="failed")
+                    main.send_error_todo(e, cfg)
+
+                inbox.wait_for_mail(imap, mapping.daemon_idle_timeout)
+        except (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError) as e:
+            delay = retry.backoff_delay(failures, mapping.daemon_reconnect_min_delay, mapping.daemon_reconnect_max_delay)
+            failures += 1
+            print(f"邮箱{name}连接中断, {retry.describe_error(e)}，等待{delay:.1f}秒后重连")
+        finally:
+            try:
+                imap.shutdown()
+            except Exception:
+                pass
+        # A session that keeps dropping (e.g. BYE right after LOGIN) backs off like a failed connect
+        time.sleep(delay)
+
+
+def serve_all():
+    """Serve the single mailbox, or every profile of config/mailboxes.json on its own thread."""
+    profiles = mailboxes.load_mailboxes(mapping.mailboxes_fn)
+    if mapping.metrics_port:
+        metrics.serve(mapping.metrics_host, mapping.metrics_port)
+        print(f"运行指标: http://{mapping.metrics_host}:{mapping.metrics_port}/metrics")
+
+    if not profiles:
+        serve(mapping)
+        return
+
+    print(f"多邮箱模式: {', '.join(profile.name for profile in profiles)}")
+    threads = [
+        threading.Thread(target=serve, args=(profile,), name=f"mailbox-{profile.name}", daemon=True)
+        for profile in profiles
+    ]
+    for thread in threads:
+        thread.start()
+    # Join with a timeout so Ctrl+C still reaches the main thread
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+
+
+if __name__ == "__main__":
+    try:
+        if profiling.requested():
+            profiling.run(serve_all)
+        else:
+            serve_all()
+    except KeyboardInterrupt:
+        pass
@@ -1,195 +1,575 @@
-from typing import List, Dict, Tuple
-import requests
-
-from datetime import datetime, timezone
-import time
-from dateutil.relativedelta import relativedelta
-
-from alibabacloud_dingtalk.todo_1_0.client import Client as dingtalktodo_1_0Client
-from alibabacloud_tea_openapi import models as open_api_models
-from alibabacloud_dingtalk.todo_1_0 import models as dingtalktodo__1__0_models
-from alibabacloud_tea_util import models as util_models
-from alibabacloud_tea_util.client import Client as UtilClient
-from alibabacloud_dingtalk.oauth2_1_0.client import Client as dingtalkoauth2_1_0Client
-from alibabacloud_dingtalk.oauth2_1_0 import models as dingtalkoauth_2__1__0_models
-
-from mapping import mapping
-
-def send_eco_todo_task(
-    contents: Dict[str, str],
-    user_ids: List[str],
-    client_id: str,
-    client_secret: str,
-):
-    """Create a DingTalk TODO task from parsed email content."""
+from typing import TYPE_CHECKING, List, Dict, Tuple, Callable, Iterator, Sequence, TypeVar
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import cached_property, partial
+
+from datetime import datetime, timezone
+import time
+from dateutil.relativedelta import relativedelta
+
+# requests and the alibabacloud SDKs take most of the startup time, so they are
+# imported on the first DingTalk call; a run without new mail never loads them
+if TYPE_CHECKING:
+    import requests
+    from alibabacloud_tea_openapi import models as open_api_models
+    from alibabacloud_tea_util import models as util_models
+
+from mapping import mapping
+import state
+import retry
+import metrics
+import outbox
+import profiling
+
+T = TypeVar("T")
+
+class DingTalkAPIError(RuntimeError):
+    """DingTalk API failure that always carries code/message attributes."""
+
+    def __init__(
+        self,
+        message: str,
+        code: str | int | None = None,
+        status_code: int | None = None,
+        retry_after: str | float | None = None,
+    ):
+        super().__init__(message)
+        self.code = str(code) if code is not None else None
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    Allows `rate` calls per second on average with bursts up to `capacity`;
+    a rate of 0 or less disables limiting.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+# Shared by every DingTalkClient in the process
+rate_limiter = TokenBucket(rate=mapping.dingtalk_qps, capacity=mapping.dingtalk_burst)
+retry_policy = retry.RetryPolicy(
+    attempts=mapping.dingtalk_retry_attempts,
+    base_delay=mapping.dingtalk_retry_base_delay,
+    max_delay=mapping.dingtalk_retry_max_delay,
+    deadline=mapping.dingtalk_call_deadline,
+)
+breaker = retry.CircuitBreaker(
+    "钉钉接口",
+    failure_threshold=mapping.dingtalk_breaker_failures,
+    reset_timeout=mapping.dingtalk_breaker_reset,
+)
+
+class HttpTransport:
+    """
+    New-API calls (oauth2 accessToken, todo tasks) as plain JSON over the
+    client's pooled requests.Session. Failures raise DingTalkAPIError with
+    the response's code, message, HTTP status and Retry-After.
+    """
 
-    def split_subject_content() -> Tuple[str, Dict]:
-        """Prepare TODO subject and body fields with defaults."""
-        subject = f"海外ECO{contents.get(mapping.ecn_index, '无编号')}导入提醒"
-
-        content = {}
-        content[mapping.ecn_index] = contents.get(mapping.ecn_index, "无内容").strip()
-        content[mapping.ecn_name] = contents.get(mapping.ecn_name, "无内容").strip()
-        content[mapping.product_name] = contents.get(mapping.product_name, "无内容").strip()
-        content[mapping.product_organizer] = contents.get(mapping.product_organizer, "无内容").strip()
-
-        return subject, content
-    
-    def cal_due_time() -> int:
-        """Compute due time with configured offsets, return milliseconds."""
-        # Due date = send date + creation offsets + due weeks + due time
-        due_date = contents[mapping.sent_date] + relativedelta(
-            months=mapping.time_month_to_create_todo,
-            weeks=mapping.due_date_from_created,
-            days=mapping.time_days_to_create_todo,
-            hour=mapping.due_time_hour,
-            minute=mapping.due_time_minute,
-            second=mapping.due_time_second
+    def __init__(self, client: "DingTalkClient"):
+        self.client = client
+        host = mapping.dingtalk_api_endpoint or "api.dingtalk.com"
+        self.base_url = f"{mapping.dingtalk_api_protocol}://{host}"
+
+    def post(self, path: str, body: Dict, token: str | None = None) -> Dict:
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["x-acs-dingtalk-access-token"] = token
+        response = self.client.session.post(
+            f"{self.base_url}{path}", headers=headers, json=body, timeout=self.client.timeout
         )
-        # If due date is before tomorrow, shift to tomorrow's due time
-        due_date = max(due_date.replace(tzinfo=None), (datetime.now() + relativedelta(days=1)).replace(tzinfo=None)) + relativedelta(
-            hour=mapping.due_time_hour,
-            minute=mapping.due_time_minute,
-            second=mapping.due_time_second
+        try:
+            result = response.json()
+        except ValueError:
+            result = {}
+        if not 200 <= response.status_code < 300:
+            raise DingTalkAPIError(
+                result.get("message") or f"HTTP {response.status_code}",
+                code=result.get("code"),
+                status_code=response.status_code,
+                retry_after=response.headers.get("Retry-After"),
+            )
+        return result
+
+    def get_access_token(self) -> Tuple[str, int]:
+        result = self.post(
+            "/v1.0/oauth2/accessToken",
+            {"appKey": self.client.client_id, "appSecret": self.client.client_secret},
+        )
+        return result["accessToken"], int(result.get("expireIn") or 0)
+
+    def create_todo_task(self, token: str, union_id: str, task: Dict):
+        self.post(f"/v1.0/todo/users/{union_id}/tasks", task, token=token)
+
+
+class SdkTransport:
+    """
+    The same calls through the alibabacloud_dingtalk (Tea) SDK, imported on
+    first use. SDK errors are re-raised as DingTalkAPIError.
+    """
+
+    def __init__(self, client: "DingTalkClient"):
+        self.client = client
+
+    @cached_property
+    def _todo_client(self):
+        from alibabacloud_dingtalk.todo_1_0.client import Client as dingtalktodo_1_0Client
+        return dingtalktodo_1_0Client(self._sdk_config())
+
+    @cached_property
+    def _oauth_client(self):
+        from alibabacloud_dingtalk.oauth2_1_0.client import Client as dingtalkoauth2_1_0Client
+        return dingtalkoauth2_1_0Client(self._sdk_config())
+
+    def _sdk_config(self) -> "open_api_models.Config":
+        from alibabacloud_tea_openapi import models as open_api_models
+
+        config = open_api_models.Config()
+        config.protocol = mapping.dingtalk_api_protocol
+        config.region_id = 'central'
+        if mapping.dingtalk_api_endpoint:
+            config.endpoint = mapping.dingtalk_api_endpoint
+        # SDK timeouts are in milliseconds
+        config.connect_timeout = int(self.client.timeout * 1000)
+        config.read_timeout = int(self.client.timeout * 1000)
+        return config
+
+    def _runtime(self) -> "util_models.RuntimeOptions":
+        from alibabacloud_tea_util import models as util_models
+
+        return util_models.RuntimeOptions(
+            connect_timeout=int(self.client.timeout * 1000),
+            read_timeout=int(self.client.timeout * 1000),
+            keep_alive=True,
+            max_idle_conns=self.client.pool_size,
         )
-        # Required by DingTalk API
-        due_time = int(due_date.timestamp() * 1000)
-        return due_time
-    
-    # Build TODO subject and content
-    subject, content = split_subject_content()
-
-    # Get app access_token
-    try:
-        app_access_token = get_app_token(client_id=client_id, client_secret=client_secret)
-        if not app_access_token:
-            raise Exception("app_access_token为空")
-    except Exception:
-        time.sleep(1)  # Avoid being rate limited by DingTalk
+
+    def _call(self, fn: Callable, *args, **kwargs):
+        from Tea.exceptions import TeaException, UnretryableException
+
         try:
-            app_access_token = get_app_token(client_id=client_id, client_secret=client_secret)
-            if not app_access_token:
-                raise Exception("app_access_token为空")
-        except Exception as e:
-            raise Exception(f"获取app_access_token失败，{e.code}: {e.message}")
-    
-    # Get union_id list for TODO recipients
-    union_ids = []
-    union_id_fails = []
-    try:
-        # Get union_id for all users
-        union_ids = [get_union_id(token=app_access_token, user_id=id) for id in user_ids]
-        # Ensure union_ids were fetched
-        if not union_ids:
-            raise Exception("union_ids为空")
-    except Exception:
-        time.sleep(1)  # Avoid being rate limited by DingTalk
-        for id in user_ids:
-            # Keep others even if some fetch fail
-            try:
-                union_id = get_union_id(token=app_access_token, user_id=id)
-                union_ids.append(union_id)
-            except Exception:
-                # Record user_ids that failed
-                union_id_fails.append(id)
-        if not union_ids:
-            raise Exception("union_ids为空")
-        # Raise if some union_ids failed
-        if union_id_fails:
-            raise Exception(f"部分union_id获取失败，失败的user_id列表：{' '.join(f'UserID: {id}' for id in union_id_fails)}")
-
-    config = open_api_models.Config()
-    config.protocol = 'https'
-    config.region_id = 'central'
-    todo_client = dingtalktodo_1_0Client(config)
-
-    # Create TODO for each recipient
-    for union_id in union_ids:
+            return fn(*args, **kwargs)
+        except UnretryableException:
+            # Network failure without a response; retried as a transient error
+            raise
+        except TeaException as e:
+            raise DingTalkAPIError(
+                e.message or str(e),
+                code=e.code,
+                status_code=getattr(e, "statusCode", None),
+            ) from e
+
+    def get_access_token(self) -> Tuple[str, int]:
+        from alibabacloud_dingtalk.oauth2_1_0 import models as dingtalkoauth_2__1__0_models
+
+        get_access_token_request = dingtalkoauth_2__1__0_models.GetAccessTokenRequest(
+            app_key=self.client.client_id,
+            app_secret=self.client.client_secret,
+        )
+        body = self._call(
+            self._oauth_client.get_access_token_with_options, get_access_token_request, {}, self._runtime()
+        ).body
+        return body.access_token, int(body.expire_in or 0)
+
+    def create_todo_task(self, token: str, union_id: str, task: Dict):
+        from alibabacloud_dingtalk.todo_1_0 import models as dingtalktodo__1__0_models
+
         create_todo_task_headers = dingtalktodo__1__0_models.CreateTodoTaskHeaders()
-        create_todo_task_headers.x_acs_dingtalk_access_token = app_access_token
+        create_todo_task_headers.x_acs_dingtalk_access_token = token
         create_todo_task_request = dingtalktodo__1__0_models.CreateTodoTaskRequest(
-            subject=subject,
-            description=create_description(content=content),
-            creator_id=union_id,
-            executor_ids=[union_id],
-            participant_ids=[union_id],
-            due_time=cal_due_time(contents[mapping.sent_date]),
+            subject=task["subject"],
+            description=task["description"],
+            creator_id=task["creatorId"],
+            executor_ids=task["executorIds"],
+            participant_ids=task["participantIds"],
+            due_time=task["dueTime"],
+        )
+        self._call(
+            self._todo_client.create_todo_task_with_options,
+            union_id=union_id, request=create_todo_task_request, headers=create_todo_task_headers, runtime=self._runtime(),
         )
 
-        # Try to create TODO, retry once on failure
+
+# mapping.dingtalk_transport -> transport class
+TRANSPORTS = {"http": HttpTransport, "sdk": SdkTransport}
+
+class DingTalkClient:
+    """
+    Long-lived DingTalk client for one app (client_id).
+    Owns a pooled requests.Session for the oapi endpoints and, with the
+    "http" transport, the new API too; the "sdk" transport reuses its
+    todo/oauth SDK clients. A run or the daemon pays TCP/TLS setup once.
+    """
+
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        pool_size: int | None = None,
+        timeout: float | None = None,
+        transport: str | None = None,
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.pool_size = pool_size or mapping.dingtalk_pool_size
+        self.timeout = timeout or mapping.dingtalk_timeout
+        transport = transport or mapping.dingtalk_transport
+        if transport not in TRANSPORTS:
+            raise RuntimeError(f"DINGTALK_TRANSPORT must be one of {', '.join(TRANSPORTS)}, got {transport!r}")
+        self.transport = TRANSPORTS[transport](self)
+
+    # The session is created (and requests imported) on first use
+    @cached_property
+    def session(self) -> "requests.Session":
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def close(self):
+        if "session" in self.__dict__:
+            self.session.close()
+
+    # ----------Access token----------
+
+    @metrics.timed("dingtalk_token")
+    def request_app_token(self) -> Tuple[str, int]:
+        """Request a new app access_token; return (token, expireIn seconds)."""
+        rate_limiter.acquire()
+        return self.transport.get_access_token()
+
+    def get_app_token(self) -> str:
+        """Use appKey/appSecret to obtain a DingTalk app access_token (cached)."""
+        return token_cache.get(client_id=self.client_id, fetch=self.request_app_token)
+
+    def get_app_token_with_retry(self) -> str:
+        """Get the app access_token under the shared retry policy."""
+        def fetch() -> str:
+            app_access_token = self.get_app_token()
+            if not app_access_token:
+                raise DingTalkAPIError("app_access_token为空")
+            return app_access_token
+
+        try:
+            return retry.call(fetch, policy=retry_policy, breaker=breaker, name="获取app_access_token")
+        except Exception as e:
+            raise DingTalkAPIError(f"获取app_access_token失败，{retry.describe_error(e)}") from e
+
+    def with_token(self, token: str, fn: Callable[[str], T]) -> T:
+        """
+        Return fn(token). If DingTalk rejects the token before it expires (e.g.
+        the app secret was reset), drop it from the cache and call fn once more
+        with a newly requested one.
+        """
         try:
-            todo_client.create_todo_task_with_options(union_id=union_id, request=create_todo_task_request, headers=create_todo_task_headers, runtime=util_models.RuntimeOptions())
-        except Exception:
-            time.sleep(1)  # Avoid being rate limited by DingTalk
+            return fn(token)
+        except Exception as e:
+            if not retry.is_auth_error(e):
+                raise
+            print(f"access_token已失效, {retry.describe_error(e)}，重新获取后重试")
+            token_cache.invalidate(self.client_id, token)
+            return fn(self.get_app_token_with_retry())
+
+    # ----------userId -> unionId----------
+
+    @metrics.timed("dingtalk_union_id")
+    def get_union_id(self, token: str, user_id: str) -> str:
+        """Query unionId by userId using the enterprise access_token."""
+        url = f"{mapping.dingtalk_oapi_base}/topapi/v2/user/get?access_token={token}"
+        headers = {
+            "Content-Type": "application/json"
+        }
+        data = {
+            "userid": user_id
+        }
+        rate_limiter.acquire()
+        response = self.session.post(url, headers=headers, json=data, timeout=self.timeout)
+        try:
+            result = response.json()
+        except ValueError:
+            result = {}
+        # oapi reports failures as errcode/errmsg, often with HTTP 200
+        if response.status_code != 200 or result.get("errcode", 0) != 0:
+            raise DingTalkAPIError(
+                result.get("errmsg") or f"HTTP {response.status_code}",
+                code=result.get("errcode"),
+                status_code=response.status_code,
+                retry_after=response.headers.get("Retry-After"),
+            )
+
+        return result["result"]["unionid"]
+
+    def get_union_ids(self, token: str, user_ids: List[str]) -> List[str]:
+        """Resolve unionIds for userIds through the cache; only misses hit the API."""
+        resolved = {}
+        union_id_fails = []
+        errors = []
+        for user_id in union_id_cache.missing(user_ids):
+            # Keep others even if some fetch fail
             try:
-                todo_client.create_todo_task_with_options(union_id=union_id, request=create_todo_task_request, headers=create_todo_task_headers, runtime=util_models.RuntimeOptions())
+                resolved[user_id] = self.with_token(token, partial(
+                    retry.call, self.get_union_id, user_id=user_id,
+                    policy=retry_policy, breaker=breaker, name="获取union_id",
+                ))
             except Exception as e:
-                raise Exception(f"创建待办失败，{e.code}: {e.message}")
-
-def send_general_todo_task(
-        client_id: str, 
-        client_secret: str, 
-        subject: str, 
-        contents: List[str], 
-        user_ids: List[str],
+                union_id_fails.append(f"UserID: {user_id} ({retry.describe_error(e)})")
+                errors.append(e)
+        union_id_cache.put_many(resolved)
+
+        # Raise if some union_ids failed, keeping code/status so an unknown userId reads as refused
+        if union_id_fails:
+            cause = next((e for e in errors if not retry.is_rejected(e)), errors[0])
+            raise DingTalkAPIError(
+                f"部分union_id获取失败，失败的user_id列表：{' '.join(union_id_fails)}",
+                code=retry.error_code(cause),
+                status_code=retry.error_status(cause),
+            )
+        union_ids = [union_id_cache.get(user_id) for user_id in user_ids]
+        if not union_ids:
+            raise DingTalkAPIError("union_ids为空")
+        return union_ids
+
+    def warm_union_ids(self, user_ids: List[str]):
+        """Resolve all configured userIds up front; the token is only requested on cache misses."""
+        if not union_id_cache.missing(user_ids):
+            return
+        try:
+            self.get_union_ids(token=self.get_app_token(), user_ids=user_ids)
+        except Exception as e:
+            # Sends resolve lazily again, so a failed warm-up is not fatal
+            print(f"预加载union_id失败: {retry.describe_error(e)}")
+
+    # ----------TODO creation----------
+
+    @metrics.timed("dingtalk_todo")
+    def create_todo(
+        self,
+        token: str,
+        union_id: str,
+        subject: str,
+        description: str,
         due_time: int,
+        executor_ids: List[str] | None = None,
     ):
-    """Send a generic TODO task, e.g., for error distribution."""
-    # Get app access_token
-    try:
-        app_access_token = get_app_token(client_id=client_id, client_secret=client_secret)
-        if not app_access_token:
-            raise Exception("app_access_token为空")
-    except Exception:
-        time.sleep(1)  # Avoid being rate limited by DingTalk
+        """
+        Create one TODO owned by union_id under the shared retry policy.
+        It is assigned to executor_ids (a shared TODO), or to union_id alone by default.
+        """
+        executor_ids = executor_ids or [union_id]
+        task = {
+            "subject": subject,
+            "description": description,
+            "creatorId": union_id,
+            "executorIds": executor_ids,
+            "participantIds": executor_ids,
+            "dueTime": due_time,
+        }
+
+        def create(token: str):
+            rate_limiter.acquire()
+            return self.transport.create_todo_task(token, union_id, task)
+
         try:
-            app_access_token = get_app_token(client_id=client_id, client_secret=client_secret)
-            if not app_access_token:
-                raise Exception("app_access_token为空")
+            self.with_token(token, partial(retry.call, create, policy=retry_policy, breaker=breaker, name="创建待办"))
         except Exception as e:
-            raise Exception(f"获取app_access_token失败，{e.code}: {e.message}")
-        
-    # Get union_id list for TODO recipients
-    try:
-        union_ids = [get_union_id(token=app_access_token, user_id=userid) for userid in user_ids]
-        if not union_ids:
-            raise Exception("union_ids为空")
-    except Exception:
-        time.sleep(1)  # Avoid being rate limited by DingTalk
+            metrics.inc("eco_todos_total", result="failed")
+            # Keep code/status so callers can tell e.g. an invalid user from throttling
+            raise DingTalkAPIError(
+                f"创建待办失败，{getattr(e, 'message', None) or str(e) or type(e).__name__}",
+                code=retry.error_code(e),
+                status_code=retry.error_status(e),
+            ) from e
+        metrics.inc("eco_todos_total", result="created")
+
+    def send_eco_todo_task(self, contents: Dict[str, str], user_ids: List[str], cfg=mapping):
+        """Create the ECO TODOs of one parsed email right away, without the outbox; raise the first error."""
+        subject, description, due_time = build_eco_todo(contents, cfg)
+        message_id = contents.get(mapping.message_id, "")
+        todos = [
+            outbox.OutboxItem(message_id, recipient, subject, description, due_time)
+            for recipient in outbox.recipient_keys(user_ids)
+        ]
+        errors = [error for _, error in self.dispatch_todos(todos) if error is not None]
+        if errors:
+            raise errors[0]
+
+    def dispatch_todos(self, todos: Sequence, max_workers: int | None = None) -> Iterator[Tuple[int, Exception | None]]:
+        """
+        Create prepared TODOs (objects with user_ids, subject, description, due_time) concurrently.
+        Yields (index, None or error) on the calling thread as each one finishes,
+        so the caller can commit every result immediately.
+        """
+        if not todos:
+            return
         try:
-            union_ids = [get_union_id(token=app_access_token, user_id=userid) for userid in user_ids]
-            if not union_ids:
-                raise Exception("union_ids为空")
+            app_access_token = self.get_app_token_with_retry()
         except Exception as e:
-            raise Exception(f"获取union_ids失败，{e.code}: {e.message}")
-    
-    config = open_api_models.Config()
-    config.protocol = 'https'
-    config.region_id = 'central'
-    todo_client = dingtalktodo_1_0Client(config)
-
-    # Create TODO for each recipient
-    for union_id in union_ids:
-        create_todo_task_headers = dingtalktodo__1__0_models.CreateTodoTaskHeaders()
-        create_todo_task_headers.x_acs_dingtalk_access_token = app_access_token
-        create_todo_task_request = dingtalktodo__1__0_models.CreateTodoTaskRequest(
-            subject=subject,
-            description=create_description(contents),
-            creator_id=union_id,
-            executor_ids=[union_id],
-            participant_ids=[union_id],
-            due_time=due_time,
-        )
-        # Try to create TODO, retry once on failure
-        try:
-            todo_client.create_todo_task_with_options(union_id=union_id, request=create_todo_task_request, headers=create_todo_task_headers, runtime=util_models.RuntimeOptions())
-        except Exception:
-            time.sleep(1)  # Avoid being rate limited by DingTalk
-            try:
-                todo_client.create_todo_task_with_options(union_id=union_id, request=create_todo_task_request, headers=create_todo_task_headers, runtime=util_models.RuntimeOptions())
-            except Exception as e:
-                raise Exception(f"创建待办失败，{str(e)}")
-            
+            # No TODO reached DingTalk, so the error carries no code/status of its own
+            error = DingTalkAPIError(f"获取access_token失败，{retry.describe_error(e)}")
+            for index in range(len(todos)):
+                yield index, error
+            return
+
+        # Resolve each recipient on its own so one bad userId only fails the TODOs it is part of
+        union_ids: Dict[str, str | Exception] = {}
+        for todo in todos:
+            for user_id in todo.user_ids:
+                if user_id not in union_ids:
+                    try:
+                        union_ids[user_id] = self.get_union_ids(token=app_access_token, user_ids=[user_id])[0]
+                    except Exception as e:
+                        union_ids[user_id] = e
+
+        with ThreadPoolExecutor(max_workers=max_workers or mapping.dingtalk_max_workers) as executor:
+            futures = {}
+            for index, todo in enumerate(todos):
+                executor_ids = [union_ids[user_id] for user_id in todo.user_ids]
+                error = next((e for e in executor_ids if isinstance(e, Exception)), None)
+                if error is not None:
+                    yield index, error
+                    continue
+                futures[executor.submit(
+                    retry.run_budget.bind(profiling.threaded(self.create_todo)),
+                    token=app_access_token,
+                    union_id=executor_ids[0],
+                    subject=todo.subject,
+                    description=todo.description,
+                    due_time=todo.due_time,
+                    executor_ids=executor_ids,
+                )] = index
+            for future in as_completed(futures):
+                yield futures[future], future.exception()
+
+    def send_general_todo_task(self, subject: str, contents: List[str], user_ids: List[str], due_time: int):
+        """Send a generic TODO task, e.g., for error distribution."""
+        # Get app access_token
+        app_access_token = self.get_app_token_with_retry()
+
+        # Get union_id list for TODO recipients (cached per userId)
+        union_ids = self.get_union_ids(token=app_access_token, user_ids=user_ids)
+
+        # Create TODO for each recipient, or one shared TODO
+        for executor_ids in executor_groups(union_ids):
+            self.create_todo(
+                token=app_access_token,
+                union_id=executor_ids[0],
+                subject=subject,
+                description=create_description(contents),
+                due_time=due_time,
+                executor_ids=executor_ids,
+            )
+
+_clients: Dict[str, DingTalkClient] = {}
+_clients_lock = threading.Lock()
+
+def get_client(client_id: str, client_secret: str) -> DingTalkClient:
+    """Return the shared DingTalkClient for this app, creating it on first use."""
+    with _clients_lock:
+        client = _clients.get(client_id)
+        if client is None or client.client_secret != client_secret:
+            client = DingTalkClient(client_id=client_id, client_secret=client_secret)
+            _clients[client_id] = client
+        return client
+
+def send_eco_todo_task(
+    contents: Dict[str, str],
+    user_ids: List[str],
+    client_id: str,
+    client_secret: str,
+    cfg=mapping,
+):
+    """Create a DingTalk TODO task from parsed email content."""
+    get_client(client_id, client_secret).send_eco_todo_task(contents=contents, user_ids=user_ids, cfg=cfg)
+
+def dispatch_todos(client_id: str, client_secret: str, todos: Sequence) -> Iterator[Tuple[int, Exception | None]]:
+    """Create prepared TODOs concurrently; yields (index, None or error) as each one finishes."""
+    return get_client(client_id, client_secret).dispatch_todos(todos=todos)
+
+def send_general_todo_task(
+        client_id: str,
+        client_secret: str,
+        subject: str,
+        contents: List[str],
+        user_ids: List[str],
+        due_time: int,
+    ):
+    """Send a generic TODO task, e.g., for error distribution."""
+    get_client(client_id, client_secret).send_general_todo_task(
+        subject=subject, contents=contents, user_ids=user_ids, due_time=due_time
+    )
+
+def executor_groups(union_ids: List[str]) -> List[List[str]]:
+    """Executors of each TODO to create under mapping.todo_dispatch_strategy."""
+    if mapping.todo_dispatch_strategy == "shared":
+        return [list(union_ids)] if union_ids else []
+    return [[union_id] for union_id in union_ids]
+
+def build_eco_todo(contents: Dict, cfg=mapping) -> Tuple[str, str, int]:
+    """Subject, description and due time (ms) of the ECO TODO for one email."""
+    subject, content = split_subject_content(contents)
+    return subject, create_description(content=content), cal_due_time(contents, cfg)
+
+def split_subject_content(contents: Dict[str, str]) -> Tuple[str, Dict]:
+    """Prepare ECO TODO subject and body fields with defaults."""
+    subject = f"海外ECO{contents.get(mapping.ecn_index, '无编号')}导入提醒"
+
+    content = {}
+    for spec in mapping.eco_field_specs:
+        value = contents.get(spec.label, spec.default)
+        content[spec.label] = value.strip() if isinstance(value, str) else str(value)
+
+    return subject, content
+
+def cal_due_time(contents: Dict, cfg=mapping) -> int:
+    """Compute ECO due time with configured offsets, return milliseconds."""
+    # Due date = send date + creation offsets + due weeks + due time
+    due_date = contents[mapping.sent_date] + relativedelta(
+        months=cfg.time_month_to_create_todo,
+        weeks=cfg.due_date_from_created,
+        days=cfg.time_days_to_create_todo,
+        hour=cfg.due_time_hour,
+        minute=cfg.due_time_minute,
+        second=cfg.due_time_second
+    )
+    # If due date is before tomorrow, shift to tomorrow's due time
+    due_date = max(due_date.replace(tzinfo=None), (datetime.now() + relativedelta(days=1)).replace(tzinfo=None)) + relativedelta(
+        hour=cfg.due_time_hour,
+        minute=cfg.due_time_minute,
+        second=cfg.due_time_second
+    )
+    # Required by DingTalk API
+    due_time = int(due_date.timestamp() * 1000)
+    return due_time
+
 def create_description(content: Dict[str, str] | List[str]) -> str:
     """Build TODO description, one field per line."""
     description = ""
@@ -197,37 +577,147 @@ def create_description(content: Dict[str, str] | List[str]) -> str:
     if isinstance(content, list):
         for item in content:
             description += f"- {item}\n"
-    elif isinstance(content, dict):
-        for key, value in content.items():
-            description += f"{key}：{value}\n"
-
+    elif isinstance(content, dict):
+        for key, value in content.items():
+            description += f"{key}：{value}\n"
+
     return description
 
+class TokenCache:
+    """
+    Thread-safe app access_token cache keyed by client_id.
+    Tokens are refreshed mapping.dingtalk_token_refresh_margin seconds before
+    expireIn runs out and optionally persisted so cron runs can reuse them.
+    """
+
+    def __init__(self, cache_fn: str | None = None):
+        self._lock = threading.Lock()
+        self._cache_fn = cache_fn
+        self._loaded = False
+        # client_id -> {"access_token": str, "expires_at": epoch seconds}
+        self._tokens: Dict[str, Dict] = {}
+
+    def get(self, client_id: str, fetch: Callable[[], Tuple[str, int]]) -> str:
+        """Return a valid token, calling fetch() for (token, expireIn) only when needed."""
+        with self._lock:
+            self._load()
+            entry = self._tokens.get(client_id)
+            if entry and entry["expires_at"] - mapping.dingtalk_token_refresh_margin > time.time():
+                return entry["access_token"]
+
+            token, expire_in = fetch()
+            self._tokens[client_id] = {"access_token": token, "expires_at": time.time() + expire_in}
+            self._save()
+            return token
+
+    def invalidate(self, client_id: str, token: str):
+        """Forget a token the server rejected, unless another thread already replaced it."""
+        with self._lock:
+            self._load()
+            entry = self._tokens.get(client_id)
+            if entry and entry["access_token"] == token:
+                del self._tokens[client_id]
+                self._save()
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self._cache_fn:
+            return
+        try:
+            with open(state.fn_relative(self._cache_fn), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict):
+            self._tokens.update({
+                k: v for k, v in data.items()
+                if isinstance(v, dict) and "access_token" in v and "expires_at" in v
+            })
+
+    def _save(self):
+        if not self._cache_fn:
+            return
+        fp = state.fn_relative(self._cache_fn)
+        try:
+            # Live tokens: owner-only from the moment the file exists
+            state.write_json_atomic(fp, self._tokens, mode=0o600)
+        except OSError as e:
+            # The cache is an optimisation; never fail a send because of it
+            print(f"保存access_token缓存失败: {str(e)}")
+
+token_cache = TokenCache(cache_fn=mapping.dingtalk_token_cache_fn)
+
 def get_app_token(client_id: str, client_secret: str) -> str:
-    """Use appKey/appSecret to obtain a DingTalk app access_token."""
-    config = open_api_models.Config()
-    config.protocol = 'https'
-    config.region_id = 'central'
-    token_client = dingtalkoauth2_1_0Client(config)
-
-    get_access_token_request = dingtalkoauth_2__1__0_models.GetAccessTokenRequest(
-        app_key=client_id,
-        app_secret=client_secret,
-    )
-
-    token = token_client.get_access_token(get_access_token_request).body.access_token
-    return token
-
-def get_union_id(token: str, user_id: str) -> str:
-    """Query unionId by userId using the enterprise access_token."""
-    url = f"https://oapi.dingtalk.com/topapi/v2/user/get?access_token={token}"
-    headers = {
-        "Content-Type": "application/json"
-    }
-    data = {
-        "userid": user_id
-    }
-    response = requests.post(url, headers=headers, json=data)
-    result = response.json()
-
-    return result["result"]["unionid"]
+    """Use appKey/appSecret to obtain a DingTalk app access_token (cached)."""
+    return get_client(client_id, client_secret).get_app_token()
+
+class UnionIdCache:
+    """
+    Thread-safe userId -> unionId cache with a TTL, persisted next to the
+    state file. The mapping practically never changes, so one lookup per
+    userId per mapping.union_id_cache_ttl_days is enough.
+    """
+
+    def __init__(self, cache_fn: str | None = None):
+        self._lock = threading.Lock()
+        self._cache_fn = cache_fn
+        self._loaded = False
+        # user_id -> {"union_id": str, "expires_at": epoch seconds}
+        self._entries: Dict[str, Dict] = {}
+
+    def get(self, user_id: str) -> str | None:
+        """Return the cached unionId, or None if missing or expired."""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(user_id)
+            if entry and entry["expires_at"] > time.time():
+                return entry["union_id"]
+            return None
+
+    def put_many(self, union_ids: Dict[str, str]):
+        """Store resolved unionIds and persist once."""
+        if not union_ids:
+            return
+        expires_at = time.time() + mapping.union_id_cache_ttl_days * 86400
+        with self._lock:
+            self._load()
+            for user_id, union_id in union_ids.items():
+                self._entries[user_id] = {"union_id": union_id, "expires_at": expires_at}
+            self._save()
+
+    def missing(self, user_ids: List[str]) -> List[str]:
+        """Return userIds without a valid cached unionId, without duplicates."""
+        return [user_id for user_id in dict.fromkeys(user_ids) if self.get(user_id) is None]
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self._cache_fn:
+            return
+        try:
+            with open(state.fn_relative(self._cache_fn), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict):
+            self._entries.update({
+                k: v for k, v in data.items()
+                if isinstance(v, dict) and "union_id" in v and "expires_at" in v
+            })
+
+    def _save(self):
+        if not self._cache_fn:
+            return
+        try:
+            state.write_json_atomic(state.fn_relative(self._cache_fn), self._entries)
+        except OSError as e:
+            print(f"保存union_id缓存失败: {str(e)}")
+
+union_id_cache = UnionIdCache(cache_fn=mapping.union_id_cache_fn)
+
+def warm_union_ids(client_id: str, client_secret: str, user_ids: List[str]):
+    """Resolve all configured userIds up front; the token is only requested on cache misses."""
+    get_client(client_id, client_secret).warm_union_ids(user_ids=user_ids)
@@ -0,0 +1,147 @@
+import json
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+class FieldSpecConfigError(RuntimeError):
+    pass
+
+
+# Value converters for the "type" key of a field spec
+FIELD_TYPES = {
+    "str": lambda value: value.strip(),
+    "int": lambda value: int(value.strip()),
+    "date": lambda value: _parse_date(value),
+}
+
+
+def _parse_date(value: str) -> datetime:
+    # dateutil's parser is only imported when a date field is configured and found
+    from dateutil import parser as date_parser
+    return date_parser.parse(value.strip())
+
+
+class FieldSpec:
+    """One ECO body field: `<label>:<value>` with the value matching `pattern`."""
+
+    def __init__(self, label: str, pattern: str, required: bool = False, type: str = "str", default: str = "无内容"):
+        self.label = label
+        self.pattern = pattern
+        self.required = required
+        self.type = type
+        self.default = default
+
+    def convert(self, value: str) -> str | int | datetime:
+        return FIELD_TYPES[self.type](value)
+
+
+class FieldExtractor:
+    """
+    One scan of the body for the labels; each field's value pattern is then
+    matched right after its label. Labels are the only thing searched, so a
+    label inside an earlier field's value is still found, and the first match
+    of each field wins: the same result as one re.search per field.
+    """
+
+    def __init__(self, specs: List[FieldSpec]):
+        self.specs = specs
+        labels = sorted({spec.label for spec in specs}, key=len, reverse=True)
+        # Longest label first; a shorter label ending the matched one shares its separator
+        self.pattern = re.compile(f"(?:{'|'.join(re.escape(label) for label in labels)})(?=[:：])")
+        self._suffixes = {
+            label: [other for other in labels if other != label and label.endswith(other)]
+            for label in labels
+        }
+        self._values: Dict[str, List[Tuple[FieldSpec, re.Pattern]]] = {}
+        for spec in specs:
+            self._values.setdefault(spec.label, []).append((spec, re.compile(rf"[:：]\s*({spec.pattern})")))
+
+    def extract(self, content: str) -> Dict[str, str | int | datetime]:
+        """Return {label: typed value} for every field found in content."""
+        result = {}
+        seen = set()
+        # str.find skips a long preamble much faster than the label alternation
+        starts = [index for index in (content.find(label) for label in self._values) if index >= 0]
+        if not starts:
+            return result
+        for match in self.pattern.finditer(content, min(starts)):
+            for label in [match.group(), *self._suffixes[match.group()]]:
+                if label in seen:
+                    continue
+                for spec, value_pattern in self._values[label]:
+                    value = value_pattern.match(content, match.end())
+                    if value is None:
+                        continue
+                    try:
+                        result[label] = spec.convert(value.group(1))
+                    except (ValueError, OverflowError):
+                        print(f"字段格式错误，已忽略: {label}{value.group(1)}")
+                    seen.add(label)
+                    break
+            if len(seen) == len(self._values):
+                break
+        return result
+
+    def missing_required(self, result: Dict) -> List[str]:
+        return [spec.label for spec in self.specs if spec.required and spec.label not in result]
+
+
+def default_field_specs(labels: List[str]) -> List[FieldSpec]:
+    """Built-in specs: the first label is a single token (ECN code), the rest run to end of line."""
+    return [
+        FieldSpec(label=label, pattern=r"[^\n\s]+" if index == 0 else r"[^\n]+")
+        for index, label in enumerate(labels)
+    ]
+
+
+def load_field_specs(path: str, default_labels: List[str]) -> List[FieldSpec]:
+    """
+    Load ECO body field specs.
+    Expected shape:
+      {"fields": [{"label": str, "pattern": str, "required": bool, "type": "str"|"int"|"date", "default": str}]}
+    Falls back to the built-in specs when the file does not exist.
+    """
+    cfg_path = Path(path)
+    if not cfg_path.exists():
+        return default_field_specs(default_labels)
+
+    try:
+        with open(cfg_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        raise FieldSpecConfigError(f"Failed to read {path}.") from e
+
+    return _parse_payload(data, path)
+
+
+def _parse_payload(data: dict, path: str) -> List[FieldSpec]:
+    if not isinstance(data, dict) or not isinstance(data.get("fields"), list) or not data["fields"]:
+        raise FieldSpecConfigError(f"{path} must be a JSON object with a non-empty fields list.")
+
+    specs = []
+    for item in data["fields"]:
+        if not isinstance(item, dict):
+            raise FieldSpecConfigError("Each field spec must be a JSON object.")
+        for key in ("label", "pattern"):
+            if not isinstance(item.get(key), str) or not item[key]:
+                raise FieldSpecConfigError(f"Field spec is missing {key}: {item}")
+        if item.get("type", "str") not in FIELD_TYPES:
+            raise FieldSpecConfigError(f"Unknown field type for {item['label']}: {item.get('type')}")
+        try:
+            re.compile(item["pattern"])
+        except re.error as e:
+            raise FieldSpecConfigError(f"Invalid pattern for {item['label']}: {e}") from e
+        specs.append(FieldSpec(
+            label=item["label"],
+            pattern=item["pattern"],
+            required=bool(item.get("required", False)),
+            type=item.get("type", "str"),
+            default=item.get("default", "无内容"),
+        ))
+
+    labels = [spec.label for spec in specs]
+    if len(set(labels)) != len(labels):
+        raise FieldSpecConfigError(f"Duplicate field labels in {path}.")
+    return specs
@@ -0,0 +1,177 @@
+from html.parser import HTMLParser
+from typing import Callable, Dict, List
+
+from mapping import mapping
+
+# Text inside these tags is never shown to the reader
+SKIP_TAGS = {"script", "style", "template"}
+CELL_TAGS = {"td", "th"}
+
+
+class TextExtractor(HTMLParser):
+    """
+    Streaming stdlib extractor.
+    Same output as BeautifulSoup(...).getText("\n", strip=True): every text
+    node stripped, empty ones dropped, joined with line breaks.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks: List[str] = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        data = data.strip()
+        if data:
+            self.chunks.append(data)
+
+    def unknown_decl(self, data):
+        # BeautifulSoup keeps CDATA sections as text
+        if data.startswith("CDATA["):
+            self.handle_data(data[len("CDATA["):])
+
+
+class CellExtractor(HTMLParser):
+    """Collect each table row as a list of cells, each cell as its stripped text nodes."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows: List[List[List[str]]] = []
+        self._row: List[List[str]] | None = None
+        self._cell: List[str] | None = None
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag == "tr":
+            self._close_row()
+            self._row = []
+        elif tag in CELL_TAGS:
+            self._close_cell()
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and self._skip:
+            self._skip -= 1
+        elif tag in CELL_TAGS:
+            self._close_cell()
+        elif tag in ("tr", "table"):
+            self._close_row()
+
+    def handle_data(self, data):
+        if self._cell is not None and not self._skip and data.strip():
+            self._cell.append(data.strip())
+
+    def _close_cell(self):
+        if self._cell is not None:
+            if self._row is None:
+                self._row = []
+            # Text nodes stay separate lines, as in BeautifulSoup's getText("\n")
+            self._row.append(self._cell)
+            self._cell = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self._row:
+            self.rows.append(self._row)
+        self._row = None
+
+    def close(self):
+        super().close()
+        self._close_row()
+
+
+def stdlib_text(html: str, labels: List[str] | None = None) -> str:
+    parser = TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return "\n".join(parser.chunks)
+
+
+def lxml_text(html: str, labels: List[str] | None = None) -> str:
+    # Optional dependency, imported on first use
+    import lxml.html
+
+    root = lxml.html.fromstring(html)
+    texts = root.xpath("//text()[not(ancestor::script) and not(ancestor::style) and not(ancestor::template)]")
+    return "\n".join(text.strip() for text in texts if text.strip())
+
+
+def table_text(html: str, labels: List[str] | None = None) -> str:
+    """
+    Only the table cells that hold a configured label, emitted as "label：value"
+    using the first line of the next cell in the same row. The full text follows
+    when some label is not in a cell (e.g. a paragraph after the table, or a
+    non-table mail); the cell lines come first, so they win.
+    """
+    labels = labels if labels is not None else [spec.label for spec in mapping.eco_field_specs]
+    parser = CellExtractor()
+    parser.feed(html)
+    parser.close()
+
+    lines = []
+    found = set()
+    for row in parser.rows:
+        for index, cell in enumerate(row):
+            if not cell:
+                continue
+            label = cell[0].rstrip(":：").strip()
+            if label in labels:
+                # The value is the next text node: later in this cell, else in the next cell
+                following = cell[1:] or (row[index + 1] if index + 1 < len(row) else [])
+                lines.append(f"{label}：{following[0] if following else ''}")
+                found.add(label)
+                continue
+            for label in labels:
+                if any(cell[0].startswith(f"{label}{sep}") for sep in (":", "：")):
+                    # Label and value share one cell
+                    lines.append("\n".join(cell))
+                    found.add(label)
+                    break
+    if len(found) < len(set(labels)):
+        lines.append(stdlib_text(html))
+    return "\n".join(lines)
+
+
+def bs4_text(html: str, labels: List[str] | None = None) -> str:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    return soup.getText("\n", strip=True)
+
+
+BACKENDS: Dict[str, Callable[..., str]] = {
+    "stdlib": stdlib_text,
+    "lxml": lxml_text,
+    "table": table_text,
+    "bs4": bs4_text,
+}
+
+
+def html_to_text(html: str, backend: str | None = None, labels: List[str] | None = None) -> str:
+    """Convert an HTML body to text lines with the configured backend, BeautifulSoup as fallback."""
+    backend = backend or mapping.html_backend
+    convert = BACKENDS.get(backend)
+    if convert is None:
+        raise ValueError(f"Unknown html_backend: {backend}")
+    if convert is bs4_text:
+        return bs4_text(html, labels)
+    try:
+        return convert(html, labels)
+    except ImportError:
+        # Optional backend (lxml) not installed
+        return bs4_text(html, labels)
+    except Exception as e:
+        print(f"HTML解析失败({backend})，改用BeautifulSoup: {e}")
+        return bs4_text(html, labels)
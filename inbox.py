@@ -1,66 +1,348 @@
-import time, imaplib, ssl
-from typing import List
+import re, time, imaplib, ssl, socket
+from typing import List, Dict, Tuple, Iterable, Iterator, Callable
 from datetime import timedelta, datetime
 from dateutil.relativedelta import relativedelta
 from mapping import mapping
+import retry
+import metrics
 
-def safe_get(mail_address: str, mail_password: str, imap_host: str, port: int) -> List:
-    """Safely pull raw email bytes from an IMAP inbox."""
+# Retry policy shared by all IMAP session attempts
+retry_policy = retry.RetryPolicy(
+    attempts=mapping.imap_retry_attempts,
+    base_delay=mapping.imap_retry_base_delay,
+    max_delay=mapping.imap_retry_max_delay,
+    deadline=mapping.imap_call_deadline,
+    retry_on=(imaplib.IMAP4.error, OSError),
+)
 
-    def get_inbox() -> List[str]:
-        """Log in, filter by date, and return matching raw emails."""
-        raw_emails = [] # Clear previous emails to avoid duplicates
+# Errors of a dropped or stalled IMAP session; other OSErrors (e.g. a full disk) are not
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, imaplib.IMAP4.error, ConnectionError, TimeoutError, ssl.SSLError, EOFError)
+
+# Headers needed by mailparser.mail_filter
+HEADER_QUERY = "(BODY.PEEK[HEADER.FIELDS (SUBJECT DATE MESSAGE-ID)])"
+
+def search_window(cfg=mapping) -> Tuple[str, str]:
+    """Return IMAP SINCE/BEFORE dates covering the configured search window."""
+    # Start = now - creation offset - search window
+    since = (
+        datetime.now()
+        - relativedelta(months=cfg.time_month_to_create_todo, days=cfg.time_days_to_create_todo)
+        - timedelta(days=cfg.mapping_search_window)
+        - timedelta(days=1)  # Include end date
+    ).strftime("%d-%b-%Y")
+     # End = now - creation offset
+    before = (
+        datetime.now()
+        - relativedelta(months=cfg.time_month_to_create_todo, days=cfg.time_days_to_create_todo)
+        + timedelta(days=1)  # Include end date
+    ).strftime("%d-%b-%Y")
+    return since, before
+
+def uid_validity(imap: imaplib.IMAP4) -> int | None:
+    """
+    UIDVALIDITY of the selected mailbox.
+    imap.response() consumes the untagged response, so the value reported by
+    SELECT is kept on the session for later runs of the daemon; a new value
+    announced by the server since replaces it.
+    """
+    _, data = imap.response("UIDVALIDITY")
+    if data and data[0] is not None:
+        imap.uidvalidity = int(data[0])
+    return getattr(imap, "uidvalidity", None)
+
+def uid_search(imap: imaplib.IMAP4, *criteria: str) -> List[int]:
+    """Run UID SEARCH and return matching UIDs in ascending order."""
+    typ, data = imap.uid("SEARCH", None, *criteria)
+    if typ != "OK":
+        raise imaplib.IMAP4.error(f"UID SEARCH失败: {typ}")
+    return sorted(int(uid) for uid in data[0].split())
+
+def search_uids(imap: imaplib.IMAP4, checkpoint: Dict | None, cfg=mapping) -> List[int]:
+    """
+    Return UIDs to download, oldest first.
+    With a valid checkpoint only UIDs above last_uid are searched; otherwise
+    the date window is scanned. The checkpoint dict is updated in place.
+    """
+    with metrics.timed("imap_search"):
+        return _search_uids(imap, checkpoint, cfg)
+
+def _search_uids(imap: imaplib.IMAP4, checkpoint: Dict | None, cfg) -> List[int]:
+    since, before = search_window(cfg)
+    validity = uid_validity(imap)
+
+    if checkpoint is None:
+        # Window mode: no checkpoint bookkeeping
+        uids = uid_search(imap, "SINCE", since, "BEFORE", before)
+        print("搜索邮件:", f"搜索到{len(uids)}封邮件")
+        return uids
+
+    mailbox = f"{cfg.mail_address}/INBOX"
+    last_uid = checkpoint.get("last_uid", 0)
+    if (
+        validity is None
+        or checkpoint.get("uidvalidity") != validity
+        or checkpoint.get("mailbox") != mailbox
+        or not isinstance(last_uid, int)
+    ):
+        # UIDVALIDITY changed or first run: rebuild from the date window
+        uids = uid_search(imap, "SINCE", since, "BEFORE", before)
+        if uids:
+            last_uid = uids[-1]
+        else:
+            # Skip everything older than the window on the next run
+            older = uid_search(imap, "BEFORE", since)
+            last_uid = older[-1] if older else 0
+        print("UIDVALIDITY变化，按日期窗口搜索:", f"搜索到{len(uids)}封邮件")
+    else:
+        # "n:*" always matches the highest UID, so drop anything <= last_uid
+        pending = [uid for uid in uid_search(imap, "UID", f"{last_uid + 1}:*") if uid > last_uid]
+        due = set(uid_search(imap, "UID", f"{last_uid + 1}:*", "BEFORE", before)) if pending else set()
+        # Stop the checkpoint before the first mail that is not due yet
+        # so that it is picked up once the creation offset has passed
+        uids = []
+        for uid in pending:
+            if uid not in due:
+                break
+            uids.append(uid)
+        if uids:
+            last_uid = uids[-1]
+        print("增量搜索邮件:", f"新邮件{len(pending)}封，待处理{len(uids)}封")
+
+    checkpoint["mailbox"] = mailbox
+    checkpoint["uidvalidity"] = validity
+    checkpoint["last_uid"] = last_uid
+    return uids
+
+def uid_set(uids: Iterable[int]) -> str:
+    """Compress UIDs into an IMAP message set, e.g. [1, 2, 3, 7] -> "1:3,7"."""
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(lo) if lo == hi else f"{lo}:{hi}" for lo, hi in ranges)
+
+def parse_fetch(data: List) -> Dict[int, bytes]:
+    """Map UID -> literal payload from an imaplib UID FETCH response."""
+    fetched = {}
+    pending = None  # Literal whose UID item comes after the payload
+    for item in data:
+        if isinstance(item, tuple):
+            match = re.search(rb"UID (\d+)", item[0])
+            if match:
+                fetched[int(match.group(1))] = item[1]
+                pending = None
+            else:
+                pending = item[1]
+        elif isinstance(item, bytes) and pending is not None:
+            match = re.search(rb"UID (\d+)", item)
+            if match:
+                fetched[int(match.group(1))] = pending
+            pending = None
+    return fetched
+
+def fetch_batched(
+    imap: imaplib.IMAP4,
+    uids: Iterable[int],
+    query: str = "(BODY.PEEK[])",
+    batch_size: int | None = None,
+) -> Iterator[Tuple[int, bytes]]:
+    """Fetch messages with one UID FETCH per batch, yielding (uid, bytes) newest first."""
+    batch_size = batch_size or mapping.imap_fetch_batch_size
+    newest_first = sorted(uids, reverse=True)
+    stage = "imap_fetch_headers" if query == HEADER_QUERY else "imap_fetch_bodies"
+
+    for i in range(0, len(newest_first), batch_size):
+        batch = newest_first[i:i + batch_size]
+        with metrics.timed(stage):
+            typ, data = imap.uid("FETCH", uid_set(batch), query)
+        if typ != "OK":
+            raise imaplib.IMAP4.error(f"UID FETCH失败: {typ}")
+
+        fetched = parse_fetch(data)
+        del data
+        # Messages expunged since the search are simply missing;
+        # pop so each message is released once the consumer is done with it
+        for uid in batch:
+            if uid in fetched:
+                yield uid, fetched.pop(uid)
+
+@metrics.timed("imap_connect")
+def connect(mail_address: str, mail_password: str, imap_host: str, port: int) -> imaplib.IMAP4:
+    """Open an authenticated IMAP session with INBOX selected read-only."""
+    if mapping.imap_ssl:
         context = ssl.create_default_context()
+        imap = imaplib.IMAP4_SSL(imap_host, port, ssl_context=context, timeout=mapping.imap_timeout)
+    else:
+        imap = imaplib.IMAP4(imap_host, port, timeout=mapping.imap_timeout)
+    try:
+        # Login
+        typ, _ = imap.login(mail_address, mail_password)
+        print("邮箱登录:", typ)
+
+        # Select inbox
+        typ, count = imap.select("INBOX", readonly=True)
+        print("选择收件箱:", typ, f"共{count[0].decode()}封邮件")
+        # Capture UIDVALIDITY from the SELECT response
+        uid_validity(imap)
+        # SELECT's EXISTS/RECENT describe the mailbox as it is, not new mail
+        pop_new_mail(imap)
+    except Exception:
+        imap.shutdown()
+        raise
+    return imap
+
+def iter_new(
+    imap: imaplib.IMAP4,
+    checkpoint: Dict | None = None,
+    header_filter: Callable[[bytes], bool] | None = None,
+    cfg=mapping,
+) -> Iterator[Tuple[int, bytes]]:
+    """Search new or in-window UIDs on an open session and yield (uid, raw email), newest first."""
+    uids = search_uids(imap, checkpoint, cfg)
+
+    # Phase one: headers only, drop mails that cannot match
+    if header_filter is not None and uids:
+        searched = len(uids)
+        uids = [
+            uid for uid, raw_header in fetch_batched(imap, uids, query=HEADER_QUERY)
+            if header_filter(raw_header)
+        ]
+        metrics.inc("eco_mails_filtered_total", searched - len(uids), phase="imap_header", result="skip")
+        print("邮件头筛选:", f"{len(uids)}封邮件需要下载正文")
+
+    # Full bodies in small batches so only a few messages are held at once
+    for uid, raw_email in fetch_batched(imap, uids, batch_size=mapping.imap_body_batch_size):
+        metrics.inc("eco_mails_fetched_total")
+        yield uid, raw_email
+
+def wait_for_mail(imap: imaplib.IMAP4, timeout: float) -> bool:
+    """
+    Block until the server reports new mail or timeout expires.
+    Uses IDLE when the server supports it, otherwise polls with NOOP.
+    Returns True if new mail was announced.
+    """
+    # EXISTS/RECENT may already have arrived during the last SEARCH/FETCH
+    if pop_new_mail(imap):
+        return True
+    if "IDLE" in imap.capabilities:
+        return _idle(imap, timeout)
+
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(mapping.daemon_poll_interval, remaining))
+        # NOOP collects untagged EXISTS/RECENT announcements
+        imap.noop()
+        if pop_new_mail(imap):
+            return True
+
+def pop_new_mail(imap: imaplib.IMAP4) -> bool:
+    """Pop untagged EXISTS/RECENT collected by earlier commands; True if they announced mail."""
+    exists = imap.untagged_responses.pop("EXISTS", None)
+    recent = imap.untagged_responses.pop("RECENT", None)
+    return bool(exists) or any(count != b"0" for count in recent or [])
+
+def _idle(imap: imaplib.IMAP4, timeout: float) -> bool:
+    """Run one IMAP IDLE round (RFC 2177) until EXISTS/RECENT or timeout."""
+    tag = imap._new_tag()
+    imap.send(tag + b" IDLE\r\n")
+    line = imap.readline()
+    if not line.startswith(b"+"):
+        raise imaplib.IMAP4.error(f"IDLE失败: {line!r}")
+
+    got_mail = False
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Read through imaplib's buffered file, so lines it already holds are seen
+            line = _readline(imap, remaining)
+            if line is None:
+                break
+            if not line or line.startswith(b"* BYE"):
+                raise imaplib.IMAP4.abort("IDLE期间连接被服务器关闭")
+            if line.rstrip().endswith((b"EXISTS", b"RECENT")):
+                got_mail = True
+                break
+    finally:
+        imap.send(b"DONE\r\n")
+        # Drain until the tagged IDLE completion
+        while True:
+            line = imap.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("IDLE结束时连接被关闭")
+            if line.startswith(tag):
+                break
+    return got_mail
+
+def _readline(imap: imaplib.IMAP4, timeout: float) -> bytes | None:
+    """imap.readline() with a socket timeout; None if no line arrived in time."""
+    previous = imap.sock.gettimeout()
+    imap.sock.settimeout(timeout)
+    try:
+        return imap.readline()
+    except socket.timeout:
+        # A file object that timed out refuses further reads; continue on a fresh one
+        imap.file = imap.sock.makefile("rb")
+        return None
+    finally:
+        imap.sock.settimeout(previous)
+
+def safe_get(
+    mail_address: str,
+    mail_password: str,
+    imap_host: str,
+    port: int,
+    checkpoint: Dict | None = None,
+    header_filter: Callable[[bytes], bool] | None = None,
+    cfg=mapping,
+) -> List[bytes]:
+    """All emails of stream() as one list; only kept for test.py, the pipeline uses stream()."""
+    return list(stream(mail_address, mail_password, imap_host, port, checkpoint, header_filter, cfg))
+
+def stream(
+    mail_address: str,
+    mail_password: str,
+    imap_host: str,
+    port: int,
+    checkpoint: Dict | None = None,
+    header_filter: Callable[[bytes], bool] | None = None,
+    cfg=mapping,
+) -> Iterator[bytes]:
+    """
+    Yield raw emails newest first as batches arrive.
+    Pass a checkpoint dict (see state.load_checkpoint) for incremental sync;
+    it is updated in place once the stream has been consumed completely.
+    Pass header_filter for a two-phase fetch: only Subject/Date/Message-ID are
+    downloaded first, and full bodies only for headers the filter accepts.
+    A dropped connection is retried by retry.call_stream under the IMAP retry
+    policy and the run budget, skipping UIDs already yielded.
+    """
+    yielded = set()
+    completed = {}
+
+    def session() -> Iterator[bytes]:
+        # Every attempt searches from the original checkpoint
+        attempt_checkpoint = dict(checkpoint) if checkpoint is not None else None
+        with connect(mail_address, mail_password, imap_host, port) as imap:
+            for uid, raw_email in iter_new(imap, attempt_checkpoint, header_filter, cfg):
+                if uid in yielded:
+                    continue
+                yielded.add(uid)
+                yield raw_email
+        completed["checkpoint"] = attempt_checkpoint
+
+    try:
+        yield from retry.call_stream(session, policy=retry_policy, name="IMAP接口")
+    except Exception as e:
+        # Surface the failure instead of pretending there was no new mail
+        raise Exception(f"调用IMAP接口失败, {retry.describe_error(e)}") from e
 
-        # Connect and log in to mailbox
-        with imaplib.IMAP4_SSL(imap_host, port, ssl_context=context) as imap:
-            # Login
-            typ, _ = imap.login(mail_address, mail_password)
-            print("邮箱登录:", typ)
-
-            # Select inbox
-            typ, count = imap.select("INBOX", readonly=True)
-            print("选择收件箱:", typ, f"共{count[0].decode()}封邮件")
-
-            # Filter emails by date
-            # Start = now - creation offset - search window
-            since = (
-                datetime.now() 
-                - relativedelta(months=mapping.time_month_to_create_todo, days=mapping.time_days_to_create_todo) 
-                - timedelta(days=mapping.mapping_search_window)
-                - timedelta(days=1)  # Include end date
-            ).strftime("%d-%b-%Y")
-             # End = now - creation offset
-            before = (
-                datetime.now() 
-                - relativedelta(months=mapping.time_month_to_create_todo, days=mapping.time_days_to_create_todo) 
-                + timedelta(days=1)  # Include end date
-            ).strftime("%d-%b-%Y")
-            typ, data = imap.search(None, 'SINCE', since, 'BEFORE', before)
-            print("搜索邮件:", typ, f"搜索到{len(data[0].split())}封邮件")
-
-            # Fetch matching emails
-            seq_ids = data[0].split()
-            for seq in reversed(seq_ids):
-                typ, data = imap.fetch(seq, "(BODY.PEEK[])")
-                raw_email = data[0][1]
-                raw_emails.append(raw_email)
-
-        return raw_emails
-
-    raw_emails = []
-    i = 0
-    timeout = 0.5
-
-    # Retry up to 3 times with backoff to handle network issues
-    while i < 3:
-        try:
-            raw_emails = get_inbox()
-            return raw_emails
-        except Exception as e:
-            print(f"调用IMAP接口失败, {str(e)}，等待{timeout}秒后重试")
-            i += 1
-            time.sleep(timeout)
-            timeout *= 2
-
-    return raw_emails
+    if checkpoint is not None:
+        checkpoint.update(completed["checkpoint"])
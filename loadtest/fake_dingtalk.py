@@ -0,0 +1,157 @@
+"""
+Stand-in for the DingTalk endpoints used by dingtalk.py.
+
+POST /v1.0/oauth2/accessToken          -> {"accessToken", "expireIn"}
+POST /topapi/v2/user/get               -> {"errcode": 0, "result": {"unionid"}}
+POST /v1.0/todo/users/{unionId}/tasks  -> {"id", ...}
+
+Latency, random server errors and throttling (HTTP 429 with a QpsLimit code,
+both at random and above a QPS ceiling) are configurable, as are userIds that
+do not exist (errcode 60121 with HTTP 200, like the real oapi). Only tokens
+issued by this server are accepted; revoke_tokens() invalidates them early.
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Set
+from urllib.parse import parse_qs, urlsplit
+
+TODO_PATH = re.compile(r"^/v1\.0/todo/users/([^/]+)/tasks$")
+THROTTLE_CODE = "Forbidden.AccessDenied.QpsLimitForApi"
+
+
+class Behaviour:
+    """Knobs and counters shared by all request threads."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        qps_limit: float | None = None,
+        retry_after: float | None = None,
+        invalid_users: Iterable[str] = (),
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.qps_limit = qps_limit
+        self.retry_after = retry_after
+        self.invalid_users = set(invalid_users)
+        self.counts: Dict[str, int] = {}
+        # Arrival time (time.time()) of every created TODO
+        self.todo_times: List[float] = []
+        self.tokens: Set[str] = set()
+        self._random = random.Random(seed)
+        self._window: List[float] = []
+        self._lock = threading.Lock()
+
+    def count(self, key: str):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def revoke_tokens(self):
+        """Reject every token issued so far, as if the app secret was reset."""
+        with self._lock:
+            self.tokens.clear()
+
+    def fault(self) -> str | None:
+        """"throttle", "error" or None for this request."""
+        with self._lock:
+            now = time.monotonic()
+            if self.qps_limit:
+                self._window = [t for t in self._window if now - t < 1.0]
+                if len(self._window) >= self.qps_limit:
+                    return "throttle"
+                self._window.append(now)
+            roll = self._random.random()
+        if roll < self.throttle_rate:
+            return "throttle"
+        if roll < self.throttle_rate + self.error_rate:
+            return "error"
+        return None
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status: int, payload: Dict, headers: Dict[str, str] | None = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        behaviour: Behaviour = self.server.behaviour
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?", 1)[0]
+        oapi = path.startswith("/topapi/")
+
+        if behaviour.latency:
+            time.sleep(behaviour.latency)
+
+        fault = behaviour.fault()
+        if fault == "throttle":
+            behaviour.count("throttled")
+            headers = {"Retry-After": str(behaviour.retry_after)} if behaviour.retry_after is not None else None
+            if oapi:
+                return self.reply(200, {"errcode": 90018, "errmsg": "qps limit"}, headers)
+            return self.reply(429, {"code": THROTTLE_CODE, "message": "qps limit"}, headers)
+        if fault == "error":
+            behaviour.count("errors")
+            if oapi:
+                return self.reply(200, {"errcode": -1, "errmsg": "system busy"})
+            return self.reply(500, {"code": "InternalError", "message": "system busy"})
+
+        if path == "/v1.0/oauth2/accessToken":
+            behaviour.count("token")
+            with behaviour._lock:
+                token = f"fake-token-{body.get('appKey', '')}-{behaviour.counts['token']}"
+                behaviour.tokens.add(token)
+            return self.reply(200, {"accessToken": token, "expireIn": 7200})
+
+        token = self.headers.get("x-acs-dingtalk-access-token") or parse_qs(urlsplit(self.path).query).get("access_token", [""])[0]
+        if token not in behaviour.tokens:
+            behaviour.count("bad_token")
+            if oapi:
+                return self.reply(200, {"errcode": 40014, "errmsg": "不合法的access_token"})
+            return self.reply(401, {"code": "InvalidAuthentication", "message": "access token is invalid"})
+        if path == "/topapi/v2/user/get":
+            behaviour.count("user_get")
+            user_id = body.get("userid", "")
+            if user_id in behaviour.invalid_users:
+                return self.reply(200, {"errcode": 60121, "errmsg": "找不到该用户"})
+            return self.reply(200, {"errcode": 0, "errmsg": "ok", "result": {"userid": user_id, "unionid": f"union-{user_id}"}})
+        match = TODO_PATH.match(path)
+        if match:
+            behaviour.count("todo")
+            with behaviour._lock:
+                behaviour.todo_times.append(time.time())
+            return self.reply(200, {
+                "id": f"task-{behaviour.counts['todo']}",
+                "subject": body.get("subject"),
+                "creatorId": match.group(1),
+                "createdTime": int(time.time() * 1000),
+            })
+        self.reply(404, {"code": "NotFound", "message": path})
+
+
+def start(behaviour: Behaviour, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Serve on a background thread; the bound port is server.server_address[1]."""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.behaviour = behaviour
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
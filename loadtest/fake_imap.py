@@ -0,0 +1,175 @@
+"""
+Minimal IMAP4rev1 server for load tests.
+
+Serves an in-memory mailbox over plain TCP with the commands inbox.py uses:
+LOGIN, SELECT/EXAMINE (UIDVALIDITY/UIDNEXT), UID SEARCH (ALL/UID/SINCE/BEFORE),
+UID FETCH (BODY.PEEK[] and HEADER.FIELDS), NOOP, IDLE and LOGOUT.
+"""
+import re
+import select
+import socketserver
+import threading
+import time
+from datetime import date, datetime
+from email.utils import parsedate_to_datetime
+from typing import List, Set
+
+DATE_HEADER = re.compile(rb"^Date:[ \t]*(.*)$", re.M | re.I)
+FIELDS = re.compile(r"FIELDS \(([^)]*)\)", re.I)
+
+
+class Mailbox:
+    """Raw messages with UID = index + 1, plus per-command latency and counters."""
+
+    def __init__(self, messages: List[bytes], uid_validity: int = 1, latency: float = 0.0):
+        self.messages = list(messages)
+        self.uid_validity = uid_validity
+        self.latency = latency
+        self.commands = 0
+        self.bytes_sent = 0
+        self._dates = [self._date(raw) for raw in self.messages]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _date(raw: bytes) -> date:
+        match = DATE_HEADER.search(raw.split(b"\r\n\r\n", 1)[0])
+        try:
+            return parsedate_to_datetime(match.group(1).decode().strip()).date()
+        except (AttributeError, TypeError, ValueError):
+            return datetime.now().date()
+
+    def add(self, raw: bytes):
+        with self._lock:
+            self.messages.append(raw)
+            self._dates.append(self._date(raw))
+
+    def date(self, uid: int) -> date:
+        return self._dates[uid - 1]
+
+
+def parse_set(spec: str, max_uid: int) -> Set[int]:
+    uids = set()
+    for part in spec.split(","):
+        if ":" in part:
+            low, high = (max_uid if x == "*" else int(x) for x in part.split(":"))
+            uids.update(range(min(low, high), max(low, high) + 1))
+        else:
+            uids.add(max_uid if part == "*" else int(part))
+    return uids
+
+
+def header_fields(raw: bytes, fields: List[str]) -> bytes:
+    """Selected header lines (with continuations) followed by the blank line."""
+    keep, current = [], False
+    for line in raw.split(b"\r\n\r\n", 1)[0].split(b"\r\n"):
+        if line[:1] in (b" ", b"\t"):
+            if current:
+                keep.append(line)
+            continue
+        current = line.split(b":", 1)[0].decode(errors="replace").upper() in fields
+        if current:
+            keep.append(line)
+    return b"\r\n".join(keep) + b"\r\n\r\n"
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def send(self, data: bytes):
+        self.wfile.write(data)
+        self.server.mailbox.bytes_sent += len(data)
+
+    def handle(self):
+        box = self.server.mailbox
+        self.send(b"* OK fake IMAP ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.decode().rstrip("\r\n").partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            box.commands += 1
+            if box.latency:
+                time.sleep(box.latency)
+
+            if command == "CAPABILITY":
+                self.send(b"* CAPABILITY IMAP4rev1 IDLE\r\n")
+            elif command in ("SELECT", "EXAMINE"):
+                count = len(box.messages)
+                self.send(
+                    f"* {count} EXISTS\r\n* OK [UIDVALIDITY {box.uid_validity}] ok\r\n"
+                    f"* OK [UIDNEXT {count + 1}] ok\r\n".encode()
+                )
+            elif command == "LOGOUT":
+                self.send(b"* BYE\r\n" + f"{tag} OK LOGOUT completed\r\n".encode())
+                return
+            elif command == "IDLE":
+                self.idle(box)
+            elif command == "UID":
+                self.uid(box, args)
+            elif command not in ("LOGIN", "NOOP"):
+                self.send(f"{tag} BAD unsupported command\r\n".encode())
+                continue
+            self.send(f"{tag} OK {command} completed\r\n".encode())
+
+    def idle(self, box: Mailbox):
+        self.send(b"+ idling\r\n")
+        count = len(box.messages)
+        while True:
+            readable, _, _ = select.select([self.connection], [], [], 0.05)
+            if readable:
+                self.rfile.readline()  # DONE
+                return
+            if len(box.messages) != count:
+                count = len(box.messages)
+                self.send(f"* {count} EXISTS\r\n".encode())
+
+    def uid(self, box: Mailbox, args: str):
+        sub, _, args = args.partition(" ")
+        max_uid = len(box.messages)
+        if sub.upper() == "SEARCH":
+            tokens = args.split()
+            result = set(range(1, max_uid + 1))
+            i = 0
+            while i < len(tokens):
+                token = tokens[i].upper()
+                if token == "UID":
+                    result &= parse_set(tokens[i + 1], max_uid) if max_uid else set()
+                    i += 2
+                elif token in ("SINCE", "BEFORE"):
+                    day = datetime.strptime(tokens[i + 1], "%d-%b-%Y").date()
+                    result = {
+                        uid for uid in result
+                        if (box.date(uid) >= day if token == "SINCE" else box.date(uid) < day)
+                    }
+                    i += 2
+                else:
+                    i += 1
+            self.send(("* SEARCH " + " ".join(map(str, sorted(result))) + "\r\n").encode())
+        elif sub.upper() == "FETCH":
+            spec, _, items = args.partition(" ")
+            fields = FIELDS.search(items)
+            fields = fields.group(1).upper().split() if fields else None
+            for uid in sorted(parse_set(spec, max_uid)):
+                if not 1 <= uid <= max_uid:
+                    continue
+                raw = box.messages[uid - 1]
+                if fields:
+                    body = header_fields(raw, fields)
+                    name = f"BODY[HEADER.FIELDS ({' '.join(fields)})]"
+                else:
+                    body, name = raw, "BODY[]"
+                self.send(f"* {uid} FETCH (UID {uid} {name} {{{len(body)}}}\r\n".encode() + body + b")\r\n")
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start(mailbox: Mailbox, host: str = "127.0.0.1", port: int = 0) -> Server:
+    """Serve mailbox on a background thread; the bound port is server.server_address[1]."""
+    server = Server((host, port), Handler)
+    server.mailbox = mailbox
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,183 @@
+"""
+End-to-end load test: a full main.py run against local IMAP and DingTalk stand-ins.
+
+Usage:
+    python loadtest/run.py --sizes 100 1000 10000 --out loadtest_results.json
+    python loadtest/run.py --sizes 1000 --dingtalk-latency 0.05 --error-rate 0.02 --throttle-rate 0.05
+    python loadtest/run.py --sizes 1000 --recipients 15 --strategy shared
+
+Each size gets a fresh mailbox generated by bench/corpus.py and a fresh
+working directory (config, state and caches), then main.run_once() runs in a
+child process with ECO_IMAP_*, DINGTALK_API_* and DINGTALK_OAPI_BASE pointing
+at the stand-ins.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(LOADTEST_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "bench"))
+
+import corpus
+import fake_dingtalk
+import fake_imap
+
+
+def percentile(values: List[float], pct: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def read_stage_seconds(metrics_fn: str) -> Dict[str, Dict]:
+    """Per-stage count and total seconds from the run's metrics.json."""
+    try:
+        with open(metrics_fn, "r", encoding="utf-8") as f:
+            histograms = json.load(f)["histograms"]
+    except (OSError, ValueError, KeyError):
+        return {}
+    return {
+        item["labels"]["stage"]: {"count": item["count"], "seconds": item["sum"]}
+        for item in histograms.get("eco_stage_seconds", [])
+    }
+
+
+def write_config(work_dir: str, recipients: int = 1):
+    config_dir = os.path.join(work_dir, "config")
+    os.makedirs(config_dir, exist_ok=True)
+    user_ids = ["load_user"] if recipients == 1 else [f"load_user_{i}" for i in range(recipients)]
+    with open(os.path.join(config_dir, "dingtalk_recipients.json"), "w", encoding="utf-8") as f:
+        json.dump({"eco_todo_user_ids": user_ids, "error_todo_user_ids": ["load_admin"]}, f)
+    eco_fields = os.path.join(REPO_DIR, "config", "eco_fields.json")
+    if os.path.exists(eco_fields):
+        with open(eco_fields, "rb") as src, open(os.path.join(config_dir, "eco_fields.json"), "wb") as dst:
+            dst.write(src.read())
+
+
+def run_size(size: int, args) -> Dict:
+    mailbox = fake_imap.Mailbox(
+        corpus.generate(size, seed=args.seed, attachment_size=args.attachment_size),
+        latency=args.imap_latency,
+    )
+    behaviour = fake_dingtalk.Behaviour(
+        latency=args.dingtalk_latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        qps_limit=args.server_qps,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    imap_server = fake_imap.start(mailbox)
+    dingtalk_server = fake_dingtalk.start(behaviour)
+    dingtalk_address = f"127.0.0.1:{dingtalk_server.server_address[1]}"
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="eco-loadtest-") as work_dir:
+            write_config(work_dir, args.recipients)
+            env = dict(
+                os.environ,
+                ECO_MAIL_ADDRESS="load@example.com",
+                ECO_MAIL_PASSWORD="load",
+                ECO_IMAP_HOST="127.0.0.1",
+                ECO_IMAP_PORT=str(imap_server.server_address[1]),
+                ECO_IMAP_SSL="0",
+                DINGTALK_CLIENT_ID="load",
+                DINGTALK_CLIENT_SECRET="load",
+                DINGTALK_API_ENDPOINT=dingtalk_address,
+                DINGTALK_API_PROTOCOL="http",
+                DINGTALK_OAPI_BASE=f"http://{dingtalk_address}",
+                DINGTALK_TRANSPORT=args.transport,
+            )
+            command = [
+                sys.executable, os.path.join(LOADTEST_DIR, "run_main.py"),
+                "--qps", str(args.qps), "--workers", str(args.workers), "--strategy", args.strategy,
+            ]
+            started = time.time()
+            child = subprocess.run(command, cwd=work_dir, env=env, capture_output=True, text=True)
+            wall_seconds = time.time() - started
+            stage_seconds = read_stage_seconds(os.path.join(work_dir, "metrics.json"))
+    finally:
+        imap_server.shutdown()
+        dingtalk_server.shutdown()
+
+    if child.returncode != 0 or not child.stdout.strip():
+        raise RuntimeError(f"main.run_once failed for {size} messages:\n{child.stdout[-2000:]}\n{child.stderr[-2000:]}")
+    timings = json.loads(child.stdout.strip().splitlines()[-1])
+
+    # Latency of each TODO from the start of run_once
+    latencies = [t - timings["started"] for t in behaviour.todo_times]
+    todos = behaviour.counts.get("todo", 0)
+    run_seconds = timings["run_seconds"]
+    return {
+        "messages": size,
+        "processed": timings["processed"],
+        "todos_created": todos,
+        "wall_seconds": round(wall_seconds, 3),
+        "import_seconds": timings["import_seconds"],
+        "run_seconds": run_seconds,
+        "msgs_per_sec": round(size / run_seconds, 1) if run_seconds else None,
+        "todos_per_sec": round(todos / run_seconds, 1) if run_seconds else None,
+        "todo_latency_seconds": {
+            "first": round(min(latencies), 3) if latencies else None,
+            "p50": round(percentile(latencies, 50), 3) if latencies else None,
+            "p95": round(percentile(latencies, 95), 3) if latencies else None,
+            "last": round(max(latencies), 3) if latencies else None,
+        },
+        "stage_seconds": stage_seconds,
+        "imap": {"commands": mailbox.commands, "bytes_sent": mailbox.bytes_sent},
+        "dingtalk": dict(behaviour.counts),
+        "error_todo_sent": "脚本运行失败" in child.stdout,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of main.run_once against local stand-ins.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--attachment-size", type=int, default=64 * 1024)
+    parser.add_argument("--imap-latency", type=float, default=0.0, help="seconds per IMAP command")
+    parser.add_argument("--dingtalk-latency", type=float, default=0.0, help="seconds per DingTalk request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of DingTalk requests failing with 5xx")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of DingTalk requests throttled")
+    parser.add_argument("--server-qps", type=float, default=None, help="throttle above this many requests per second")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds on throttled replies")
+    parser.add_argument("--qps", type=float, default=1000, help="client token bucket rate (mapping.dingtalk_qps)")
+    parser.add_argument("--workers", type=int, default=8, help="mapping.dingtalk_max_workers")
+    parser.add_argument("--transport", default="http", choices=["http", "sdk"], help="DINGTALK_TRANSPORT")
+    parser.add_argument("--recipients", type=int, default=1, help="ECO TODO recipients per email")
+    parser.add_argument("--strategy", default="per_recipient", choices=["per_recipient", "shared"],
+                        help="mapping.todo_dispatch_strategy")
+    parser.add_argument("--out", default="loadtest_results.json")
+    args = parser.parse_args()
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("sizes", "out")},
+        "results": {},
+    }
+    for size in args.sizes:
+        print(f"压测{size}封邮件...")
+        result = run_size(size, args)
+        report["results"][str(size)] = result
+        print(
+            f"{size:>6} msgs: {result['run_seconds']}s, {result['msgs_per_sec']} msgs/s, "
+            f"{result['todos_created']} todos, p95 {result['todo_latency_seconds']['p95']}s"
+        )
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入: {os.path.abspath(args.out)}")
+
+
+if __name__ == "__main__":
+    main()
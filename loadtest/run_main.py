@@ -0,0 +1,53 @@
+"""
+Child process of loadtest/run.py: one timed main.run_once() against the
+stand-in servers, printing a JSON line with the timings.
+
+Run from the load test's working directory so config/ and state files stay there.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+started_import = time.time()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mapping import mapping
+import main
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--qps", type=float, default=mapping.dingtalk_qps)
+    parser.add_argument("--workers", type=int, default=mapping.dingtalk_max_workers)
+    parser.add_argument("--strategy", default=mapping.todo_dispatch_strategy)
+    args = parser.parse_args()
+
+    # Keep every state/cache file in the working directory, not next to the code
+    for name in ("json_fn", "json_journal_fn", "imap_checkpoint_fn", "outbox_fn", "dingtalk_token_cache_fn", "union_id_cache_fn"):
+        setattr(mapping, name, os.path.abspath(getattr(mapping, name)))
+    mapping.metrics_fn = os.path.abspath("metrics.json")
+    mapping.dingtalk_qps = args.qps
+    mapping.dingtalk_burst = max(1, int(args.qps))
+    mapping.dingtalk_max_workers = args.workers
+    mapping.todo_dispatch_strategy = args.strategy
+    # Module-level caches and limiter were built from the defaults at import time
+    main.dingtalk.token_cache = main.dingtalk.TokenCache(mapping.dingtalk_token_cache_fn)
+    main.dingtalk.union_id_cache = main.dingtalk.UnionIdCache(mapping.union_id_cache_fn)
+    main.dingtalk.rate_limiter = main.dingtalk.TokenBucket(args.qps, mapping.dingtalk_burst)
+
+    started = time.time()
+    main.run_once()
+    finished = time.time()
+    print(json.dumps({
+        "import_seconds": round(started - started_import, 3),
+        "started": started,
+        "finished": finished,
+        "run_seconds": round(finished - started, 3),
+        "processed": len(main.state.processed_store()),
+    }))
+
+
+if __name__ == "__main__":
+    main_()
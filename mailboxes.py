@@ -0,0 +1,125 @@
+import os
+import re
+import json
+from pathlib import Path
+from typing import Dict, List
+
+from mapping import mapping
+
+
+class MailboxConfigError(RuntimeError):
+    pass
+
+
+# Config key -> mapping attribute it overrides, with the accepted type
+PROFILE_KEYS = {
+    "mail_address": ("mail_address", str),
+    "mail_password": ("mail_password", str),
+    "imap_host": ("imap_host", str),
+    "imap_port": ("port", int),
+    "subject_keyword": ("ECO_requried_subject", str),
+    "eco_todo_user_ids": ("DingDing_ids", list),
+    "error_todo_user_ids": ("error_user_ids", list),
+    "time_month_to_create_todo": ("time_month_to_create_todo", int),
+    "time_days_to_create_todo": ("time_days_to_create_todo", int),
+    "due_date_from_created": ("due_date_from_created", int),
+    "due_time_hour": ("due_time_hour", int),
+    "due_time_minute": ("due_time_minute", int),
+    "due_time_second": ("due_time_second", int),
+}
+
+# Profile names become folder names of the state shards
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class MailboxProfile:
+    """
+    One mailbox of the multi-mailbox mode.
+    Holds only the overridden settings; every other attribute falls back to
+    mapping, so a profile can be passed wherever `cfg=mapping` is accepted.
+    """
+
+    def __init__(self, name: str, overrides: Dict):
+        self.name = name
+        self.__dict__.update(overrides)
+        # Own state shard: processed IDs, journal, UID checkpoint and outbox
+        shard = os.path.join(mapping.mailbox_state_dir, name)
+        self.json_fn = os.path.join(shard, os.path.basename(mapping.json_fn))
+        self.json_journal_fn = os.path.join(shard, os.path.basename(mapping.json_journal_fn))
+        self.imap_checkpoint_fn = os.path.join(shard, os.path.basename(mapping.imap_checkpoint_fn))
+        self.outbox_fn = os.path.join(shard, os.path.basename(mapping.outbox_fn))
+
+    def __getattr__(self, item):
+        return getattr(mapping, item)
+
+    def __repr__(self) -> str:
+        return f"MailboxProfile({self.name!r}, {self.mail_address!r})"
+
+
+def load_mailboxes(path: str) -> List[MailboxProfile]:
+    """
+    Load mailbox profiles for the multi-mailbox mode.
+    Expected shape:
+      {"mailboxes": [{"name": str, "mail_address": str, "mail_password" | "mail_password_env": str, ...}]}
+    Optional keys override mapping per mailbox, see PROFILE_KEYS.
+    Returns an empty list when the file does not exist (single-mailbox mode).
+    """
+    cfg_path = Path(path)
+    if not cfg_path.exists():
+        return []
+
+    try:
+        with open(cfg_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        raise MailboxConfigError(f"Failed to read {path}.") from e
+
+    return _parse_payload(data, path)
+
+
+def _parse_payload(data: dict, path: str) -> List[MailboxProfile]:
+    if not isinstance(data, dict) or not isinstance(data.get("mailboxes"), list) or not data["mailboxes"]:
+        raise MailboxConfigError(f"{path} must be a JSON object with a non-empty mailboxes list.")
+
+    profiles = []
+    names = set()
+    for item in data["mailboxes"]:
+        if not isinstance(item, dict):
+            raise MailboxConfigError("Each mailbox profile must be a JSON object.")
+
+        name = item.get("name")
+        if not isinstance(name, str) or not NAME_PATTERN.match(name):
+            raise MailboxConfigError(f"Mailbox name must use letters, digits, '_' or '-': {name!r}")
+        if name in names:
+            raise MailboxConfigError(f"Duplicate mailbox name: {name}")
+        names.add(name)
+
+        unknown = set(item) - set(PROFILE_KEYS) - {"name", "mail_password_env"}
+        if unknown:
+            raise MailboxConfigError(f"Unknown keys in mailbox {name}: {', '.join(sorted(unknown))}")
+
+        # Keep passwords out of the file by naming an env var instead
+        item = dict(item)
+        if "mail_password_env" in item:
+            env_name = item.pop("mail_password_env")
+            item["mail_password"] = os.getenv(env_name, "")
+            if not item["mail_password"]:
+                raise MailboxConfigError(f"Environment variable {env_name} for mailbox {name} is not set or is empty.")
+
+        for key in ("mail_address", "mail_password"):
+            if not item.get(key):
+                raise MailboxConfigError(f"Mailbox {name} is missing {key}.")
+
+        overrides = {}
+        for key, value in item.items():
+            if key == "name":
+                continue
+            attribute, expected = PROFILE_KEYS[key]
+            if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+                raise MailboxConfigError(f"{key} of mailbox {name} must be {expected.__name__}.")
+            if expected is list and (not value or not all(isinstance(v, str) for v in value)):
+                raise MailboxConfigError(f"{key} of mailbox {name} must be a non-empty list of strings.")
+            overrides[attribute] = value
+
+        profiles.append(MailboxProfile(name, overrides))
+    return profiles
@@ -2,17 +2,31 @@ import io
 from datetime import datetime, time
 from dateutil.relativedelta import relativedelta
 from email import policy, message
-from email.parser import BytesParser
+from email.parser import BytesParser, BytesHeaderParser
 from email.header import decode_header
 from email.utils import parsedate_to_datetime
-from bs4 import BeautifulSoup
 import re
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 from mapping import mapping
+from eco_fields import FieldExtractor
+import htmltext
 import state
+import metrics
 
+# Field specs are compiled once into a single pattern, on first use
+_field_extractor: FieldExtractor | None = None
 
+
+def field_extractor() -> FieldExtractor:
+    """The shared FieldExtractor for mapping.eco_field_specs, built on first use."""
+    global _field_extractor
+    if _field_extractor is None:
+        _field_extractor = FieldExtractor(mapping.eco_field_specs)
+    return _field_extractor
+
+
+@metrics.timed("parse")
 def mail_parser(eml: bytes) -> message.EmailMessage:
     """Convert input to EmailMessage for uniform handling."""
     if isinstance(eml, message.EmailMessage):
@@ -24,13 +38,26 @@ def mail_parser(eml: bytes) -> message.EmailMessage:
     else:
         raise TypeError(f"邮件解析格式错误: {type(eml)}")
 
+def parse_headers(eml: bytes) -> message.Message:
+    """
+    Fast path: parse only the header block with the compat32 header parser.
+    Scanning stops at the blank line that ends the headers; no MIME tree is built.
+    """
+    ends = [i + len(sep) for sep in (b"\r\n\r\n", b"\n\n") if (i := eml.find(sep)) != -1]
+    head = eml[:min(ends)] if ends else eml
+    return BytesHeaderParser(policy=policy.compat32).parsebytes(head)
+
 def decode_mime(s: bytes):
     """Decode a MIME header and return readable text."""
     parts = decode_header(s)
-    return "".join([(b.decode(enc or "utf-8") if isinstance(b, bytes) else b) for b, enc in parts])
+    # compat32 reports raw 8-bit header bytes as charset "unknown-8bit"
+    return "".join([
+        (b.decode("utf-8", "replace") if enc == "unknown-8bit" else b.decode(enc or "utf-8")) if isinstance(b, bytes) else b
+        for b, enc in parts
+    ])
 
-def mail_filter(msg: message.EmailMessage) -> message.EmailMessage|None:
-    """Filter processed, future, or mismatched emails; return None or the msg."""
+def filter_fields(msg: message.Message, cfg=mapping) -> Tuple[str, datetime | None, str]:
+    """Read subject, TODO creation date and Message-ID used by the filter rules."""
 
     # Init variables
     Subject = ""
@@ -46,29 +73,49 @@ def mail_filter(msg: message.EmailMessage) -> message.EmailMessage|None:
             # Calc TODO creation date: send date + month/day offsets
             date_to_create_todo = (
                 date 
-                + relativedelta(months=mapping.time_month_to_create_todo) 
-                + relativedelta(days=mapping.time_days_to_create_todo)
+                + relativedelta(months=cfg.time_month_to_create_todo) 
+                + relativedelta(days=cfg.time_days_to_create_todo)
             )
             # Set creation time to 00:00:00 for comparison
             date_to_create_todo = datetime.combine(date_to_create_todo.date(), time.min)
         elif header == mapping.message_id:
-            ID = decode_mime(msg[header])
+            ID = state.normalize_message_id(decode_mime(msg[header]))
 
-    json_info = state.load_json()
-    # Return None if email already processed
-    if not ID or ID in list(json_info.keys()):
-        return None
+    return Subject, date_to_create_todo, ID
 
-    # Return None if creation date is in the future
+def passes_filter(Subject: str, date_to_create_todo: datetime | None, ID: str, cfg=mapping) -> bool:
+    """Business rules shared by mail_filter and filter_headers."""
+    # Reject if email already processed (indexed lookup, loaded once per run)
+    if not ID or state.processed_store(cfg).is_processed(ID):
+        return False
+
+    # Reject if creation date is in the future
     if not date_to_create_todo or date_to_create_todo > datetime.now():
-        return None
+        return False
     
-    # Return None if subject misses business keyword
-    if not mapping.ECO_requried_subject in Subject:
+    # Reject if subject misses business keyword
+    if not cfg.ECO_requried_subject in Subject:
+        return False
+
+    return True
+
+@metrics.timed("filter")
+def mail_filter(msg: message.EmailMessage, cfg=mapping) -> message.EmailMessage|None:
+    """Filter processed, future, or mismatched emails; return None or the msg."""
+    if not passes_filter(*filter_fields(msg, cfg), cfg=cfg):
         return None
-    
     return msg
+
+@metrics.timed("filter")
+def filter_headers(eml: bytes, cfg=mapping) -> bool:
+    """Apply mail_filter rules to raw bytes, decoding only Subject/Date/Message-ID."""
+    return passes_filter(*filter_fields(parse_headers(eml), cfg), cfg=cfg)
+
+def header_filter(raw_header: bytes, cfg=mapping) -> bool:
+    """Apply mail_filter rules to a header-only fetch (Subject/Date/Message-ID)."""
+    return filter_headers(raw_header, cfg)
     
+@metrics.timed("extract")
 def extract_useful_parts(msg: message.EmailMessage) -> Dict[str, str | datetime]:
 
     def extract_header(msg: message.EmailMessage, result: Dict[str, str | datetime]) -> Dict[str, str | datetime]:
@@ -80,41 +127,12 @@ def extract_useful_parts(msg: message.EmailMessage) -> Dict[str, str | datetime]
                 # Convert sent date to datetime
                 result[mapping.sent_date] = parsedate_to_datetime(decode_mime(msg[header]))
             elif header == mapping.message_id:
-                result[mapping.message_id] = decode_mime(msg[header])
+                result[mapping.message_id] = state.normalize_message_id(decode_mime(msg[header]))
         return result
     
-    def extract_body(content: str, result: Dict[str, str]) -> Dict[str, str]:
-        """Pull ECO key fields from body."""
-        content_str = content.strip()
-
-        # Use regex to extract key fields
-        # Skip if not found
-        ecn_index = re.search(rf"(?:{mapping.ecn_index}[:：]\s*)([^\n\s]+)", content_str)
-        if ecn_index:
-            ecn_index = ecn_index.group(1)
-
-        ecn_name = re.search(rf"(?:{mapping.ecn_name}[:：]\s*)([^\n]+)", content_str)
-        if ecn_name:
-            ecn_name = ecn_name.group(1)
-
-        product_name = re.search(rf"(?:{mapping.product_name}[:：]\s*)([^\n]+)", content_str)
-        if product_name:
-            product_name = product_name.group(1)
-
-        product_organizer = re.search(rf"(?:{mapping.product_organizer}[:：]\s*)([^\n]+)", content_str)
-        if product_organizer:
-            product_organizer = product_organizer.group(1)
-
-        # Add extracted fields to result dict
-        if ecn_index:
-            useful_parts[mapping.ecn_index] = ecn_index
-        if ecn_name:
-            useful_parts[mapping.ecn_name] = ecn_name
-        if product_name:
-            useful_parts[mapping.product_name] = product_name
-        if product_organizer:
-            useful_parts[mapping.product_organizer] = product_organizer
-
+    def extract_body(content: str, result: Dict[str, str | datetime]) -> Dict[str, str | datetime]:
+        """Pull ECO key fields from body in one pass with the compiled field specs."""
+        result.update(field_extractor().extract(content.strip()))
         return result
 
     useful_parts: Dict[str, str | datetime] = {}
@@ -133,10 +151,17 @@ def extract_useful_parts(msg: message.EmailMessage) -> Dict[str, str | datetime]
             useful_parts = extract_body(content=txt, result=useful_parts)
             break
         elif part.get_content_type() == "text/html":
-            soup = BeautifulSoup(part.get_content(), "html.parser")
-            txt = soup.getText("\n",strip=True)
+            txt = htmltext.html_to_text(part.get_content())
             useful_parts = extract_body(content=txt, result=useful_parts)
             break
         
     return useful_parts
 
+def parse_and_extract(eml: bytes) -> Tuple[Dict[str, str | datetime], Tuple[Dict, Dict]]:
+    """
+    Parse raw bytes and extract the useful parts in one call (backfill worker).
+    Only the small picklable dict crosses the process boundary, never the EmailMessage,
+    together with the worker's parse/extract metrics for the parent to merge.
+    """
+    contents = extract_useful_parts(mail_parser(eml))
+    return contents, metrics.registry.pop_all()
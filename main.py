@@ -4,76 +4,219 @@ load_dotenv()
 
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+from typing import Deque, Dict, Iterable, Iterator, List
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from functools import partial
+from email import message
 from mapping import mapping
 import time
 import mailparser
 import dingtalk
 import state
 import inbox
+import retry
+import metrics
+import mailboxes
+import outbox
+import profiling
 import sys
+import os
 
-try:
-    # Fetch recent raw emails via IMAP securely (bytes list)
-    raw_emails = inbox.safe_get(
-        mail_address=mapping.mail_address,
-        mail_password=mapping.mail_password,
-        imap_host=mapping.imap_host,
-        port=mapping.port,
-    )
-    filtered_emails = []
-    json_data_to_save = state.load_json()
-
-    # Filter emails one by one
+
+class TodoFailures(Exception):
+    """Some TODOs failed; every fetched email was still handled (queued in the outbox)."""
+
+
+class MailFailures(Exception):
+    """Some emails could not be turned into TODOs; they are neither queued nor processed, so keep the checkpoint."""
+
+
+def mailbox_name(cfg=mapping) -> str:
+    """Profile name for logs and metrics; "default" for the single mailbox in mapping."""
+    return getattr(cfg, "name", "default")
+
+
+def filter_stage(raw_emails: Iterable[bytes], cfg=mapping) -> Iterator[bytes]:
+    """Keep only emails that meet business rules, judged from their headers alone."""
+    for raw_email in raw_emails:
+        if mailparser.filter_headers(raw_email, cfg):
+            metrics.inc("eco_mails_filtered_total", phase="pipeline", result="pass")
+            yield raw_email
+        else:
+            metrics.inc("eco_mails_filtered_total", phase="pipeline", result="skip")
+
+
+def parse_stage(raw_emails: Iterable[bytes]) -> Iterator[message.EmailMessage]:
+    """Build the full EmailMessage only for emails that passed the filter."""
+    for raw_email in raw_emails:
+        yield mailparser.mail_parser(raw_email)
+
+
+def extract_stage(msgs: Iterable[message.EmailMessage]) -> Iterator[Dict]:
+    """Extract subject/sent time/body info into small dicts; the EmailMessage is dropped here."""
+    for msg in msgs:
+        contents = mailparser.extract_useful_parts(msg=msg)
+        if is_complete(contents):
+            yield contents
+
+
+def backfill_stage(raw_emails: Iterable[bytes], pool: Executor) -> Iterator[Dict]:
+    """
+    Parse and extract on worker processes, yielding the dicts in input order.
+    At most backfill_prefetch mails per worker are in flight, so a long
+    backlog is streamed rather than submitted all at once.
+    """
+    in_flight = max(1, backfill_workers() * mapping.backfill_prefetch)
+    pending: Deque[Future] = deque()
     for raw_email in raw_emails:
-        # Parse raw email into EmailMessage
-        msg = mailparser.mail_parser(raw_email)
+        pending.append(pool.submit(mailparser.parse_and_extract, raw_email))
+        if len(pending) >= in_flight:
+            contents = worker_result(pending.popleft())
+            if is_complete(contents):
+                yield contents
+    while pending:
+        contents = worker_result(pending.popleft())
+        if is_complete(contents):
+            yield contents
+
 
-        # Keep only emails that meet business rules (else None)
-        msg_filtered = mailparser.mail_filter(msg=msg)
+def worker_result(future: Future) -> Dict:
+    """Extracted dict of a backfill worker; its parse/extract metrics go into this process's registry."""
+    contents, worker_metrics = future.result()
+    metrics.registry.merge(worker_metrics)
+    return contents
 
-        if msg_filtered:
-            filtered_emails.append(msg_filtered)
 
-    # Exit if no matching emails
-    if filtered_emails is None or len(filtered_emails) == 0:
+def is_complete(contents: Dict) -> bool:
+    """True if the extracted dict has a Message-ID and every required field."""
+    if not contents or mapping.message_id not in contents:
+        print(f"提取邮件关键信息失败，跳过处理{mapping.message_id}{contents.get(mapping.message_id, '无ID')}")
+        return False
+    # Required fields come from config/eco_fields.json
+    missing = mailparser.field_extractor().missing_required(contents)
+    if missing:
+        print(f"邮件缺少必填字段{', '.join(missing)}，跳过处理{mapping.message_id}{contents[mapping.message_id]}")
+        return False
+    return True
+
+
+def batch_stage(items: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    """Group items into lists of at most size."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def process_emails(raw_emails: Iterable[bytes], cfg=mapping, pool: Executor | None = None) -> int:
+    """
+    Stream raw emails through filter -> parse -> extract -> enqueue -> send; return emails sent.
+    Each email becomes one outbox row per recipient and its Message-ID is marked
+    processed right away, so it is never fetched again; every TODO is committed
+    in the outbox as soon as it was created. Unsent rows of earlier runs are
+    retried first, without touching IMAP. An email whose TODO cannot be built is
+    not marked processed and raises MailFailures, so the checkpoint stays before it.
+    cfg is mapping or a mailbox profile (recipients, offsets, state shard).
+    With a pool (backfill mode) parse and extract run on its worker processes.
+    """
+    store = state.processed_store(cfg)
+    if pool is None:
+        contents_stream = extract_stage(parse_stage(filter_stage(raw_emails, cfg)))
+    else:
+        contents_stream = backfill_stage(filter_stage(raw_emails, cfg), pool)
+
+    box = outbox.Outbox(state.fn_relative(cfg.outbox_fn))
+    sent = 0
+    failures = []
+    # Emails left out of the outbox; they must be fetched again
+    unqueued = []
+    try:
+        # Resume TODOs left unsent by earlier runs
+        sent += send_outbox(box, box.unsent(), cfg, failures)
+
+        for contents_list in batch_stage(contents_stream, mapping.pipeline_batch_size):
+            queued = []
+            for contents in contents_list:
+                message_id = contents[mapping.message_id]
+                try:
+                    subject, description, due_time = dingtalk.build_eco_todo(contents, cfg)
+                except Exception as e:
+                    print(f"生成待办失败: {mapping.ecn_index}{contents.get(mapping.ecn_index, '无主题')}, {retry.describe_error(e)}")
+                    unqueued.append(f"{message_id}: {retry.describe_error(e)}")
+                    metrics.inc("eco_mails_failed_total", mailbox=mailbox_name(cfg))
+                    continue
+                box.enqueue(message_id, outbox.recipient_keys(cfg.DingDing_ids), subject, description, due_time)
+                # The outbox owns the email from here on
+                store.add(message_id)
+                queued.append(message_id)
+
+            # Send DingTalk TODOs of the batch concurrently
+            sent += send_outbox(box, box.unsent(queued), cfg, failures)
+    finally:
+        store.save()
+        box.prune(state.retention_cutoff(cfg))
+        box.close()
+
+    # Nothing to do if no matching emails
+    if sent == 0 and not failures and not unqueued:
         print("没有新邮件")
-        time.sleep(15)
-        sys.exit(0)
+    if unqueued:
+        raise MailFailures(f"{len(unqueued)}封邮件生成待办失败: {'; '.join(unqueued + failures)}")
+    if failures:
+        raise TodoFailures(f"{len(failures)}个待办创建失败: {'; '.join(failures)}")
+    return sent
 
-    for filtered_email in filtered_emails:
-        # Skip if filtered email is empty
-        if not filtered_email:
-            continue
 
-        # Extract subject/sent time/body info into dict
-        contents = mailparser.extract_useful_parts(msg=filtered_email)
-        if not contents or mapping.message_id not in contents:
-            print(f"提取邮件关键信息失败，跳过处理{mapping.message_id}{contents.get(mapping.message_id, '无ID')}")
+def send_outbox(box: outbox.Outbox, items: List[outbox.OutboxItem], cfg, failures: List[str]) -> int:
+    """Create the items' TODOs, committing each result; return emails whose TODOs are now all created."""
+    for index, error in dingtalk.dispatch_todos(mapping.client_id, mapping.client_secret, items):
+        item = items[index]
+        if error is None:
+            box.mark_sent(item)
             continue
+        dead = box.mark_failed(item, retry.describe_error(error), counted=retry.is_rejected(error))
+        note = "，已放弃重试" if dead else ""
+        print(f"钉钉待办发送失败: {item.subject}, UserID: {item.user_id}, {retry.describe_error(error)}{note}")
+        failures.append(f"{item.message_id} ({item.user_id}): {retry.describe_error(error)}{note}")
+
+    sent = 0
+    for message_id, subject in dict((item.message_id, item.subject) for item in items).items():
+        if box.is_done(message_id):
+            print(f"钉钉待办发送成功: {subject}")
+            sent += 1
+            metrics.inc("eco_mails_sent_total", mailbox=mailbox_name(cfg))
+        else:
+            metrics.inc("eco_mails_failed_total", mailbox=mailbox_name(cfg))
+    return sent
 
-        # Send DingTalk TODO using configured recipients and credentials
-        dingtalk.send_eco_todo_task(
-            contents=contents,
-            user_ids=mapping.DingDing_ids,
-            client_id=mapping.client_id,
-            client_secret=mapping.client_secret,
-        )
-        print(f"钉钉待办发送成功: {mapping.ecn_index}{contents.get(mapping.ecn_index, '无主题')}")
 
-        # Record processing time to avoid reprocessing
-        now_time = datetime.now().strftime(mapping.json_time_format)
-        json_data_to_save[contents[mapping.message_id]] = now_time
+def send_error_todo(e: Exception, cfg=mapping):
+    """Forward a run failure to the configured error recipients as a TODO."""
+    contents = [
+        mapping.error_description,
+        f"错误详情: {retry.describe_error(e)}",
+        f"时间: {datetime.now().strftime(mapping.json_time_format)}"
+    ]
+    if cfg is not mapping:
+        contents.insert(1, f"邮箱: {mailbox_name(cfg)} ({cfg.mail_address})")
 
-    state.save_json(data=json_data_to_save)
-except Exception as e:
-    # Catch all exceptions and send error TODO
-    print(f"脚本运行失败: {str(e)}")
+    # The error report must not be blocked by an exhausted run budget
+    with retry.run_budget.exempt():
+        _send_error_todo(e, contents, cfg.error_user_ids)
+
+
+def _send_error_todo(e: Exception, contents: List[str], user_ids: List[str]):
     try:
         # Compute error TODO due time at next configured moment
         target_time = datetime.now().replace(
-            hour=mapping.error_due_time_hour, 
-            minute=mapping.error_due_time_minute, 
-            second=mapping.error_due_time_second, 
+            hour=mapping.error_due_time_hour,
+            minute=mapping.error_due_time_minute,
+            second=mapping.error_due_time_second,
             tzinfo=None
         )
         # If now past cutoff, move to same time tomorrow
@@ -85,19 +228,138 @@ except Exception as e:
         # Send error TODO
         dingtalk.send_general_todo_task(
             subject=mapping.error_subject,
-            contents=[
-                mapping.error_description,
-                f"错误详情: {str(e)}",
-                f"时间: {datetime.now().strftime(mapping.json_time_format)}"
-            ],
-            user_ids=mapping.error_user_ids,
+            contents=contents,
+            user_ids=user_ids,
             client_id=mapping.client_id,
             client_secret=mapping.client_secret,
             due_time=due_time,
         )
-        print(f"发送报错代办成功: {str(e)}")
+        print(f"发送报错代办成功: {retry.describe_error(e)}")
     except Exception as e2:
-        print(f"发送报错代办失败: {str(e2)}")
-finally:
-    time.sleep(15)  # Prevent script from exiting too fast
-    sys.exit(0)
+        print(f"发送报错代办失败: {retry.describe_error(e2)}")
+
+
+def write_metrics():
+    """Write run metrics to mapping.metrics_fn; a failed write never fails the run."""
+    if not mapping.metrics_fn:
+        return
+    try:
+        metrics.write(state.fn_relative(mapping.metrics_fn))
+    except OSError as e:
+        print(f"写入运行指标失败: {e}")
+
+
+def process_mailbox(cfg=mapping, pool: Executor | None = None):
+    """Fetch new or in-window mail of one mailbox, send TODOs, save its state shard."""
+    try:
+        # Resolve all configured recipients' unionIds once (cached on disk)
+        dingtalk.warm_union_ids(
+            client_id=mapping.client_id,
+            client_secret=mapping.client_secret,
+            user_ids=cfg.DingDing_ids + cfg.error_user_ids,
+        )
+
+        # Incremental sync resumes from the saved UID checkpoint
+        checkpoint = state.load_checkpoint(cfg) if mapping.imap_sync_mode == "incremental" else None
+
+        # Stream recent raw emails via IMAP securely, newest first
+        raw_emails = inbox.stream(
+            mail_address=cfg.mail_address,
+            mail_password=cfg.mail_password,
+            imap_host=cfg.imap_host,
+            port=cfg.port,
+            checkpoint=checkpoint,
+            header_filter=partial(mailparser.header_filter, cfg=cfg) if mapping.imap_two_phase_fetch else None,
+            cfg=cfg,
+        )
+
+        try:
+            process_emails(raw_emails, cfg, pool)
+        except TodoFailures:
+            # Failed TODOs are retried from the outbox, the mails need not be fetched again
+            if checkpoint is not None:
+                state.save_checkpoint(data=checkpoint, cfg=cfg)
+            raise
+
+        # Advance the UID checkpoint only after every email was handled
+        if checkpoint is not None:
+            state.save_checkpoint(data=checkpoint, cfg=cfg)
+        metrics.inc("eco_runs_total", mailbox=mailbox_name(cfg), result="ok")
+    except Exception as e:
+        # Catch all exceptions and send error TODO
+        print(f"脚本运行失败({mailbox_name(cfg)}): {retry.describe_error(e)}")
+        metrics.inc("eco_runs_total", mailbox=mailbox_name(cfg), result="failed")
+        send_error_todo(e, cfg)
+
+
+def process_mailboxes(profiles: List[mailboxes.MailboxProfile], pool: Executor | None = None):
+    """Process every mailbox profile on its own worker and IMAP connection."""
+    workers = min(mapping.mailbox_max_workers, len(profiles))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mailbox") as executor:
+        # process_mailbox reports its own failures, so one mailbox never stops the others
+        list(executor.map(retry.run_budget.bind(profiling.threaded(partial(process_mailbox, pool=pool))), profiles))
+
+
+def backfill_workers() -> int:
+    """Worker processes of the backfill pool (mapping.backfill_workers, default all cores)."""
+    return mapping.backfill_workers or os.cpu_count() or 1
+
+
+def backfill_requested() -> bool:
+    """True when started with --backfill or ECO_BACKFILL is set to a true value."""
+    if "--backfill" in sys.argv[1:]:
+        return True
+    return os.getenv("ECO_BACKFILL", "").strip().lower() in ("1", "true", "yes")
+
+
+def run_once(backfill: bool | None = None):
+    """
+    One-shot run over the single mailbox, or every profile of config/mailboxes.json.
+    backfill (default: backfill_requested()) spreads parse/extract over a process pool
+    shared by all mailboxes, for catching up on a large backlog.
+    """
+    retry.run_budget.start(mapping.run_time_budget)
+    started = time.perf_counter()
+    if backfill is None:
+        backfill = backfill_requested()
+    pool = None
+    if backfill:
+        # multiprocessing is only imported when a backfill needs it
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # Workers are started while mailbox threads run; a forked one could inherit a held lock
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        pool = ProcessPoolExecutor(max_workers=backfill_workers(), mp_context=multiprocessing.get_context(method))
+    if pool is not None:
+        print(f"补录模式: {backfill_workers()}个解析进程")
+        if profiling.active():
+            print("注意: 补录模式的解析和提取在子进程中运行，不在性能分析范围内")
+    try:
+        try:
+            profiles = mailboxes.load_mailboxes(mapping.mailboxes_fn)
+        except mailboxes.MailboxConfigError as e:
+            print(f"脚本运行失败: {retry.describe_error(e)}")
+            send_error_todo(e)
+            return
+
+        if profiles:
+            print(f"多邮箱模式: {', '.join(profile.name for profile in profiles)}")
+            process_mailboxes(profiles, pool)
+        else:
+            process_mailbox(mapping, pool)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        metrics.observe("eco_stage_seconds", time.perf_counter() - started, stage="run")
+        write_metrics()
+
+
+if __name__ == "__main__":
+    try:
+        if profiling.requested():
+            profiling.run(run_once)
+        else:
+            run_once()
+    finally:
+        time.sleep(15)  # Prevent script from exiting too fast
+        sys.exit(0)
@@ -1,6 +1,7 @@
 from __future__ import annotations
 import os
 from dingtalk_recipients import load_dingtalk_recipients, DingtalkRecipientConfigError
+from eco_fields import load_field_specs, FieldSpecConfigError
 
 
 def _get_env_or_raise(name: str) -> str:
@@ -10,7 +11,62 @@ def _get_env_or_raise(name: str) -> str:
     return value
 
 
-class mapping:
+class _LazySettings(type):
+    """
+    Settings that need an env var or a config file are computed on first
+    access by their loader in `_lazy` and then stored on the class, so
+    importing mapping reads nothing and a run only loads what it uses.
+    """
+
+    def __getattr__(cls, name: str):
+        loader = cls.__dict__.get("_lazy", {}).get(name)
+        if loader is None:
+            raise AttributeError(f"type object '{cls.__name__}' has no attribute '{name}'")
+        value = loader(cls)
+        setattr(cls, name, value)
+        return value
+
+
+def _load_eco_field_specs(cfg) -> list:
+    try:
+        return load_field_specs(cfg.eco_fields_fn, [cfg.ecn_index, cfg.ecn_name, cfg.product_name, cfg.product_organizer])
+    except FieldSpecConfigError as e:
+        raise RuntimeError(str(e))
+
+
+def _load_recipients(cfg) -> dict:
+    try:
+        return load_dingtalk_recipients(cfg.dingtalk_recipients_fn)
+    except DingtalkRecipientConfigError as e:
+        raise RuntimeError(str(e))
+
+
+def _load_error_user_ids(cfg) -> list:
+    error_user_ids = cfg._recipients.get("error_todo_user_ids", [])
+    if not error_user_ids:
+        raise RuntimeError(
+            "error_todo_user_ids must include at least one user ID in "
+            "config/dingtalk_recipients.json."
+        )
+    return error_user_ids
+
+
+def _load_mail_env(name: str):
+    # Optional in multi-mailbox mode, where every profile has its own
+    return lambda cfg: os.getenv(name) if cfg.multi_mailbox else _get_env_or_raise(name)
+
+
+def _load_port(cfg) -> int:
+    try:
+        port = int(os.getenv("ECO_IMAP_PORT", "993"))
+    except ValueError as e:
+        raise RuntimeError("ECO_IMAP_PORT must be an integer") from e
+    if not (1 <= port <= 65535):
+        raise RuntimeError("ECO_IMAP_PORT must be between 1 and 65535")
+    return port
+
+
+class mapping(metaclass=_LazySettings):
     # ----------Email content extraction----------
     # Business keywords
     ECO_requried_subject = "ECO审批流程"
@@ -25,6 +81,12 @@ class mapping:
     ecn_name = "ecn名称"
     product_name = "产品名称"
     product_organizer = "工作负责人"
+    # Field specs (label/pattern/required/type) from config, loaded lazily as eco_field_specs;
+    # built-in defaults cover the four fields above
+    eco_fields_fn = "config/eco_fields.json"
+    # HTML body to text: "stdlib" (streaming html.parser), "lxml" (optional),
+    # "table" (only labelled table cells) or "bs4" (BeautifulSoup, also the fallback)
+    html_backend = "stdlib"
 
     # ----------DingTalk TODO settings----------
 
@@ -42,48 +104,165 @@ class mapping:
     # IMAP search window days before target date
     # Helps cover outages or network drops
     mapping_search_window = 10  # days
+    # "incremental": only fetch UIDs above the saved checkpoint,
+    # falling back to the date window when UIDVALIDITY changes
+    # "window": always scan the whole date window
+    imap_sync_mode = "incremental"
+    # Messages requested per UID FETCH round trip
+    imap_fetch_batch_size = 200
+    # Full-body batch size; bounds how many raw emails are held in memory
+    imap_body_batch_size = 20
+    # Fetch Subject/Date/Message-ID first and download full bodies
+    # only for mails that pass mail_filter
+    imap_two_phase_fetch = True
+
+    # ----------Daemon mode (daemon.py)----------
+    # Re-issue IDLE at least this often (servers drop IDLE after ~30 min)
+    daemon_idle_timeout = 600  # seconds
+    # NOOP polling interval when the server lacks IDLE
+    daemon_poll_interval = 30  # seconds
+    # Reconnect backoff bounds after the session drops
+    daemon_reconnect_min_delay = 1  # seconds
+    daemon_reconnect_max_delay = 300  # seconds
+
+    # ----------Streaming pipeline (main.py)----------
+    # Extracted emails sent (and committed) per dispatch batch
+    pipeline_batch_size = 20
+
+    # ----------Backfill mode (main.py --backfill or ECO_BACKFILL=1)----------
+    # Worker processes for parse/extract; None uses every CPU core
+    backfill_workers = None
+    # Mails in flight per worker process; bounds memory while keeping mail order
+    backfill_prefetch = 4
+
+    # ----------Retry policy (retry.py)----------
+    # IMAP: attempts per run, backoff bounds and deadline across attempts
+    imap_retry_attempts = 3
+    imap_retry_base_delay = 0.5  # seconds
+    imap_retry_max_delay = 8  # seconds
+    imap_call_deadline = 120  # seconds
+    # Socket timeout of each IMAP read/write, so a stalled SEARCH or FETCH raises instead of hanging
+    imap_timeout = 60  # seconds
+    # DingTalk: per-call attempts, backoff bounds and deadline across attempts
+    dingtalk_retry_attempts = 3
+    dingtalk_retry_base_delay = 1  # seconds
+    dingtalk_retry_max_delay = 10  # seconds
+    dingtalk_call_deadline = 30  # seconds
+    # DingTalk throttling error codes; Retry-After is honoured when present
+    dingtalk_throttle_codes = [
+        "Forbidden.AccessDenied.QpsLimitForApi",
+        "Forbidden.AccessDenied.QpsLimitForAppkeyAndApi",
+        "Forbidden.AccessDenied.QpsLimitForAppkey",
+        "90018",
+        "90019",
+    ]
+    # Other DingTalk error codes that are retried (oapi -1: system busy);
+    # any other code fails at once without counting toward the circuit breaker
+    dingtalk_transient_codes = ["-1"]
+    # Circuit breaker: open after N consecutive failures, retry after reset time
+    dingtalk_breaker_failures = 5
+    dingtalk_breaker_reset = 60  # seconds
+    # Overall time budget for one run (None disables)
+    run_time_budget = 600  # seconds
+
+    # ----------Metrics (metrics.py)----------
+    # Written at the end of each run: Prometheus textfile format, or JSON for *.json (None disables)
+    metrics_fn = "metrics.prom"
+    # Local /metrics endpoint in daemon mode (None disables)
+    metrics_host = "127.0.0.1"
+    metrics_port = 9108
+
+    # ----------Profiling (--profile or ECO_PROFILE=1)----------
+    # Folder for .pstats and .tracemalloc dumps, next to the state file
+    profile_dir = "profiles"
+    # Functions and allocation sites listed in the run log
+    profile_top = 15
+    # Stack depth kept per allocation; more frames cost more overhead
+    profile_traceback_frames = 1
 
     # ----------Local state file----------
     # JSON filename and timestamp format for processed mail
     json_fn = "processed_messages.json"
     json_time_format = "%Y-%m-%d %H:%M:%S"
+    # Append-only journal of processed Message-IDs, used to recover the JSON snapshot
+    json_journal_fn = "processed_messages.journal"
+    # Keep entries this many days beyond the search window before compaction drops them
+    state_retention_margin_days = 30  # days
+    # Rewrite the journal once it holds this many lines more than the snapshot
+    state_journal_slack = 500
+    # IMAP UIDVALIDITY / last UID checkpoint for incremental sync
+    imap_checkpoint_fn = "imap_checkpoint.json"
+    # SQLite outbox: one row per (Message-ID, recipient) TODO with its send status
+    outbox_fn = "outbox.sqlite3"
+    # Failed TODOs are retried on later runs and given up once DingTalk refused them this often;
+    # outages, throttling and open circuits do not count
+    outbox_max_attempts = 10
 
     # -----------DingTalk assignees-----------
-    # UserIDs from DingTalk config file
-    try:
-        _recipients = load_dingtalk_recipients("config/dingtalk_recipients.json")
-    except DingtalkRecipientConfigError as e:
-        raise RuntimeError(str(e))
-    DingDing_ids = _recipients.get("eco_todo_user_ids", [])
+    # UserIDs from DingTalk config file, loaded lazily as DingDing_ids / error_user_ids
+    dingtalk_recipients_fn = "config/dingtalk_recipients.json"
 
     # ----------Error TODO forwarding----------
     error_subject = "ECO自动创建代办-错误"
     error_description = "在处理邮件时发生错误，请及时处理。"
-    # DingTalk UserIDs to receive error TODO
-    error_user_ids = _recipients.get("error_todo_user_ids", [])
-    if not error_user_ids:
-        raise RuntimeError(
-            "error_todo_user_ids must include at least one user ID in "
-            "config/dingtalk_recipients.json."
-        )
     # Absolute due time for error TODO
     error_due_time_hour = 18
     error_due_time_minute = 0
     error_due_time_second = 0
 
     # ----------Mail and DingTalk config----------
-    # IMAP server settings
-    mail_address = _get_env_or_raise("ECO_MAIL_ADDRESS")
-    mail_password = _get_env_or_raise("ECO_MAIL_PASSWORD")
+    # Multi-mailbox mode: profiles in this file replace the single mailbox below
+    mailboxes_fn = "config/mailboxes.json"
+    # State shards live in <mailbox_state_dir>/<profile name>/
+    mailbox_state_dir = "state"
+    # Mailboxes processed in parallel, each with its own IMAP connection
+    mailbox_max_workers = 4
+
+    # IMAP server settings; mail_address, mail_password and port are loaded lazily
     imap_host = os.getenv("ECO_IMAP_HOST", "imap.qiye.aliyun.com")
-    port_str = os.getenv("ECO_IMAP_PORT", "993")
-    try:
-        port = int(port_str)
-    except ValueError as e:
-        raise RuntimeError("ECO_IMAP_PORT must be an integer") from e
-    if not (1 <= port <= 65535):
-        raise RuntimeError("ECO_IMAP_PORT must be between 1 and 65535")
+    # Plain IMAP is only meant for local test servers
+    imap_ssl = os.getenv("ECO_IMAP_SSL", "true").strip().lower() not in ("0", "false", "no")
 
     # DingTalk app settings
-    client_id = _get_env_or_raise("DINGTALK_CLIENT_ID")
-    client_secret = _get_env_or_raise("DINGTALK_CLIENT_SECRET")
+    # API hosts; override only to point at a local stand-in (see loadtest/)
+    dingtalk_api_endpoint = os.getenv("DINGTALK_API_ENDPOINT") or None  # host[:port], SDK default api.dingtalk.com
+    dingtalk_api_protocol = os.getenv("DINGTALK_API_PROTOCOL", "https")
+    dingtalk_oapi_base = os.getenv("DINGTALK_OAPI_BASE", "https://oapi.dingtalk.com").rstrip("/")
+    # "http": direct JSON calls over the pooled session; "sdk": alibabacloud_dingtalk (Tea) SDK
+    dingtalk_transport = os.getenv("DINGTALK_TRANSPORT", "http").strip().lower()
+    # Cache file for app access_token (None keeps it in memory only)
+    dingtalk_token_cache_fn = "dingtalk_token.json"
+    # Refresh the cached token this long before expireIn runs out
+    dingtalk_token_refresh_margin = 300  # seconds
+    # Error codes of a rejected token: it is dropped and the call retried once with a new one
+    dingtalk_auth_error_codes = ["InvalidAuthentication", "40014", "42001", "88"]
+    # Connection pool size and per-request timeout for DingTalkClient
+    dingtalk_pool_size = 10
+    dingtalk_timeout = 10  # seconds
+    # "per_recipient": one TODO per recipient (N calls per email);
+    # "shared": one TODO per email with every recipient as executor (1 call)
+    todo_dispatch_strategy = "per_recipient"
+    # Concurrent TODO creation; 1 worker keeps the old one-at-a-time behaviour
+    dingtalk_max_workers = 4
+    # Shared token bucket, kept under DingTalk's default 20 QPS per app and API
+    dingtalk_qps = 15  # calls per second
+    dingtalk_burst = 15  # calls
+    # userId -> unionId cache stored next to the state file
+    union_id_cache_fn = "dingtalk_union_ids.json"
+    union_id_cache_ttl_days = 7  # days
+    # client_id / client_secret are loaded lazily from DINGTALK_CLIENT_ID / DINGTALK_CLIENT_SECRET
+
+    # ----------Lazily loaded settings (see _LazySettings)----------
+    # Read on first access, so a run that never needs them never loads them
+    _lazy = {
+        "eco_field_specs": _load_eco_field_specs,
+        "_recipients": _load_recipients,
+        "DingDing_ids": lambda cfg: cfg._recipients.get("eco_todo_user_ids", []),
+        "error_user_ids": _load_error_user_ids,
+        "multi_mailbox": lambda cfg: os.path.exists(cfg.mailboxes_fn),
+        "mail_address": _load_mail_env("ECO_MAIL_ADDRESS"),
+        "mail_password": _load_mail_env("ECO_MAIL_PASSWORD"),
+        "port": _load_port,
+        "client_id": lambda cfg: _get_env_or_raise("DINGTALK_CLIENT_ID"),
+        "client_secret": lambda cfg: _get_env_or_raise("DINGTALK_CLIENT_SECRET"),
+    }
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import threading
+from contextlib import ContextDecorator
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Latency buckets in seconds, from a single parse to a slow IMAP search
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+DESCRIPTIONS = {
+    "eco_stage_seconds": "Time spent per pipeline stage.",
+    "eco_mails_fetched_total": "Raw emails downloaded from IMAP.",
+    "eco_mails_filtered_total": "Emails checked by the filter, by result.",
+    "eco_mails_sent_total": "Emails whose TODOs were all created, by mailbox.",
+    "eco_mails_failed_total": "Emails with at least one failed TODO, by mailbox.",
+    "eco_todos_total": "TODO create calls, by result.",
+    "eco_retries_total": "Retried backend calls, by call name.",
+    "eco_runs_total": "Pipeline runs, by mailbox and result.",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+
+class Registry:
+    """Process-wide counters and histograms, safe to update from worker threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            series.setdefault(key, Histogram()).observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def pop_all(self) -> Tuple[Dict, Dict]:
+        """Take every series out of the registry, e.g. to hand a worker process's metrics to the parent."""
+        with self._lock:
+            data = self._counters, self._histograms
+            self._counters, self._histograms = {}, {}
+        return data
+
+    def merge(self, data: Tuple[Dict, Dict]):
+        """Add series taken with pop_all() (in another process) to this registry."""
+        counters, histograms = data
+        with self._lock:
+            for name, series in counters.items():
+                target = self._counters.setdefault(name, {})
+                for key, value in series.items():
+                    target[key] = target.get(key, 0) + value
+            for name, series in histograms.items():
+                target = self._histograms.setdefault(name, {})
+                for key, h in series.items():
+                    merged = target.setdefault(key, Histogram())
+                    merged.counts = [a + b for a, b in zip(merged.counts, h.counts)]
+                    merged.sum += h.sum
+                    merged.count += h.count
+
+    def to_dict(self) -> Dict:
+        """JSON-friendly snapshot: {"counters": {name: [...]}, "histograms": {name: [...]}}."""
+        with self._lock:
+            counters = {
+                name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                for name, series in self._counters.items()
+            }
+            histograms = {
+                name: [
+                    {
+                        "labels": dict(key),
+                        "count": h.count,
+                        "sum": round(h.sum, 6),
+                        "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], _cumulative(h.counts))),
+                    }
+                    for key, h in series.items()
+                ]
+                for name, series in self._histograms.items()
+            }
+        return {"counters": counters, "histograms": histograms}
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (0.0.4)."""
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                _header(lines, name, "counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_labels(key)} {_number(value)}")
+            for name, series in sorted(self._histograms.items()):
+                _header(lines, name, "histogram")
+                for key, h in series.items():
+                    for bound, count in zip([_number(b) for b in BUCKETS] + ["+Inf"], _cumulative(h.counts)):
+                        lines.append(f"{name}_bucket{_labels(key + (('le', bound),))} {count}")
+                    lines.append(f"{name}_sum{_labels(key)} {_number(h.sum)}")
+                    lines.append(f"{name}_count{_labels(key)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _cumulative(counts: List[int]) -> List[int]:
+    total, result = 0, []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+
+def _header(lines: List[str], name: str, kind: str):
+    if name in DESCRIPTIONS:
+        lines.append(f"# HELP {name} {DESCRIPTIONS[name]}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _labels(key: Labels) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in key) + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+registry = Registry()
+
+
+def inc(name: str, value: float = 1, **labels: str):
+    registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels: str):
+    registry.observe(name, value, **labels)
+
+
+class timed(ContextDecorator):
+    """Record the duration of a block or function in eco_stage_seconds{stage=...}."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._local = threading.local()
+
+    def __enter__(self):
+        # Per-thread start times so one decorator can time concurrent calls
+        starts = getattr(self._local, "starts", None)
+        if starts is None:
+            starts = self._local.starts = []
+        starts.append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        started = self._local.starts.pop()
+        registry.observe("eco_stage_seconds", time.perf_counter() - started, stage=self.stage)
+        return False
+
+
+def write(fn: str | None):
+    """Write all metrics to fn: JSON for *.json, Prometheus textfile format otherwise."""
+    if not fn:
+        return
+    if fn.endswith(".json"):
+        content = json.dumps(registry.to_dict(), ensure_ascii=False, indent=2)
+    else:
+        content = registry.render_prometheus()
+    folder = os.path.dirname(os.path.abspath(fn))
+    os.makedirs(folder, exist_ok=True)
+    # The textfile collector may read at any time, so replace atomically
+    tmp = f"{fn}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp, fn)
+
+
+def serve(host: str, port: int) -> "ThreadingHTTPServer":
+    """Serve /metrics on a background thread (daemon mode)."""
+    # http.server is only needed by the daemon, so one-shot runs skip importing it
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,145 @@
+import sqlite3
+from datetime import datetime
+from typing import Iterable, List
+
+from mapping import mapping
+
+# user_id holds one userId, or the comma-joined userIds of a shared TODO
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS todos (
+    message_id  TEXT NOT NULL,
+    user_id     TEXT NOT NULL,
+    subject     TEXT NOT NULL,
+    description TEXT NOT NULL,
+    due_time    INTEGER NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    last_error  TEXT,
+    updated_at  TEXT NOT NULL,
+    PRIMARY KEY (message_id, user_id)
+)
+"""
+
+# pending: not tried yet; failed: retried on the next run; sent: done;
+# dead: gave up after DingTalk refused it outbox_max_attempts times
+PENDING, FAILED, SENT, DEAD = "pending", "failed", "sent", "dead"
+
+TODO_DISPATCH_STRATEGIES = ("per_recipient", "shared")
+
+
+def recipient_keys(user_ids: List[str]) -> List[str]:
+    """
+    Outbox recipients of one email under mapping.todo_dispatch_strategy:
+    each userId on its own, or all of them comma-joined for one shared TODO.
+    """
+    if mapping.todo_dispatch_strategy not in TODO_DISPATCH_STRATEGIES:
+        raise ValueError(f"Unknown todo_dispatch_strategy: {mapping.todo_dispatch_strategy}")
+    if mapping.todo_dispatch_strategy == "shared" and user_ids:
+        return [",".join(user_ids)]
+    return list(user_ids)
+
+
+class OutboxItem:
+    """One TODO to create: an email's TODO for one recipient, or for all of them if shared."""
+
+    def __init__(self, message_id: str, user_id: str, subject: str, description: str, due_time: int, attempts: int = 0):
+        self.message_id = message_id
+        self.user_id = user_id
+        self.subject = subject
+        self.description = description
+        self.due_time = due_time
+        self.attempts = attempts
+
+    @property
+    def user_ids(self) -> List[str]:
+        """Executors of this TODO; more than one for a shared TODO."""
+        return self.user_id.split(",")
+
+    def __repr__(self) -> str:
+        return f"OutboxItem({self.message_id!r}, {self.user_id!r})"
+
+
+class Outbox:
+    """
+    Durable queue of DingTalk TODOs, one row per (Message-ID, recipient key).
+    Every enqueue and every result is committed at once, so a failed or
+    interrupted run resumes only the unsent items and never repeats a sent one.
+    Use from one thread; each mailbox opens its own outbox file.
+    """
+
+    def __init__(self, fn: str):
+        self._conn = sqlite3.connect(fn)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def enqueue(self, message_id: str, user_ids: List[str], subject: str, description: str, due_time: int):
+        """Add one pending row per recipient; rows that already exist are left untouched."""
+        now = _now()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO todos (message_id, user_id, subject, description, due_time, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(message_id, user_id, subject, description, due_time, now) for user_id in user_ids],
+            )
+
+    def unsent(self, message_ids: Iterable[str] | None = None) -> List[OutboxItem]:
+        """Pending and failed rows, oldest first; limited to message_ids if given."""
+        query = (
+            "SELECT message_id, user_id, subject, description, due_time, attempts FROM todos "
+            f"WHERE status IN ('{PENDING}', '{FAILED}')"
+        )
+        params: List[str] = []
+        if message_ids is not None:
+            params = list(message_ids)
+            if not params:
+                return []
+            query += f" AND message_id IN ({', '.join('?' * len(params))})"
+        query += " ORDER BY rowid"
+        return [OutboxItem(*row) for row in self._conn.execute(query, params)]
+
+    def mark_sent(self, item: OutboxItem):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE todos SET status = ?, attempts = attempts + 1, last_error = NULL, updated_at = ? "
+                "WHERE message_id = ? AND user_id = ?",
+                (SENT, _now(), item.message_id, item.user_id),
+            )
+
+    def mark_failed(self, item: OutboxItem, error: str, counted: bool = True) -> bool:
+        """
+        Record a failed attempt; return True if the item was given up (dead).
+        Attempts that are not counted (DingTalk did not refuse it, e.g. it was down) keep it failed.
+        """
+        if counted:
+            item.attempts += 1
+        status = DEAD if counted and item.attempts >= mapping.outbox_max_attempts else FAILED
+        with self._conn:
+            self._conn.execute(
+                "UPDATE todos SET status = ?, attempts = ?, last_error = ?, updated_at = ? "
+                "WHERE message_id = ? AND user_id = ?",
+                (status, item.attempts, error, _now(), item.message_id, item.user_id),
+            )
+        return status == DEAD
+
+    def is_done(self, message_id: str) -> bool:
+        """True if every recipient's TODO of this email was created."""
+        row = self._conn.execute(
+            "SELECT COUNT(*) FROM todos WHERE message_id = ? AND status != ?", (message_id, SENT)
+        ).fetchone()
+        return row[0] == 0
+
+    def prune(self, cutoff: datetime):
+        """Delete sent and dead rows last updated before cutoff."""
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM todos WHERE status IN (?, ?) AND updated_at < ?",
+                (SENT, DEAD, cutoff.strftime(mapping.json_time_format)),
+            )
+
+
+def _now() -> str:
+    return datetime.now().strftime(mapping.json_time_format)
@@ -0,0 +1,160 @@
+import os
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from typing import TYPE_CHECKING, Callable, List, TypeVar
+
+from mapping import mapping
+import state
+
+if TYPE_CHECKING:
+    import cProfile
+    import pstats
+
+T = TypeVar("T")
+
+# Pipeline functions whose cumulative time is always reported
+STAGE_FUNCTIONS = [
+    ("inbox.py", "fetch_batched"),
+    ("mailparser.py", "mail_parser"),
+    ("mailparser.py", "filter_headers"),
+    ("mailparser.py", "extract_useful_parts"),
+    ("htmltext.py", "html_to_text"),
+    ("state.py", "load_state"),
+    ("state.py", "save"),
+    ("dingtalk.py", "create_todo"),
+]
+
+
+# Thread running run(), while it is active
+_run_thread: int | None = None
+# Finished worker-thread profilers, merged into the report of run()
+_thread_profilers: List["cProfile.Profile"] = []
+_thread_profilers_lock = threading.Lock()
+
+
+def requested() -> bool:
+    """True when started with --profile or ECO_PROFILE is set to a true value."""
+    if "--profile" in sys.argv[1:]:
+        return True
+    return os.getenv("ECO_PROFILE", "").strip().lower() in ("1", "true", "yes")
+
+
+def active() -> bool:
+    """True while run() is profiling."""
+    return _run_thread is not None
+
+
+@contextmanager
+def thread_profile():
+    """
+    Profile the block on a worker thread while run() is active; cProfile only
+    sees the thread that enabled it. The profile is merged into run()'s report.
+    Does nothing outside run() or on run()'s own thread.
+    """
+    if _run_thread is None or threading.get_ident() == _run_thread:
+        yield
+        return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ allows one profiler at a time; it is process-wide and already sees this thread
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with _thread_profilers_lock:
+            _thread_profilers.append(profiler)
+
+
+def threaded(fn: Callable[..., T]) -> Callable[..., T]:
+    """Wrap fn, submitted to a thread pool, so that each call runs under thread_profile()."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with thread_profile():
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def run(fn: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Run fn under cProfile and tracemalloc.
+    Writes <profile_dir>/<name>-<time>.pstats and .tracemalloc dumps and
+    prints the heaviest functions and allocation sites, even if fn raises.
+    Worker threads are included where they use thread_profile() (mailbox
+    workers, TODO sends); backfill worker processes are not profiled.
+    """
+    global _run_thread
+    # Imported here so that a normal run does not pay for the profilers
+    import cProfile
+    import pstats
+
+    name = getattr(fn, "__name__", "run")
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    base = os.path.join(state.fn_relative(fn=None, sub_folder=mapping.profile_dir), f"{name}-{stamp}")
+
+    profiler = cProfile.Profile()
+    tracemalloc.start(mapping.profile_traceback_frames)
+    before = tracemalloc.take_snapshot()
+    _run_thread = threading.get_ident()
+    profiler.enable()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+        _run_thread = None
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats = pstats.Stats(profiler)
+        with _thread_profilers_lock:
+            for thread_profiler in _thread_profilers:
+                stats.add(thread_profiler)
+            threads = len(_thread_profilers)
+            _thread_profilers.clear()
+        stats.dump_stats(f"{base}.pstats")
+        after.dump(f"{base}.tracemalloc")
+        print(summary(stats, after.compare_to(before, "lineno"), peak))
+        if threads:
+            print(f"已合并{threads}段工作线程的性能数据")
+        print(f"性能分析文件: {base}.pstats, {base}.tracemalloc")
+
+
+def summary(stats: "pstats.Stats", allocations, peak: int) -> str:
+    """Short text report: pipeline stages, top functions by own time, top allocation sites."""
+    top = mapping.profile_top
+    lines = ["========== 性能分析 =========="]
+
+    # stats.stats: (file, line, function) -> (calls, primitive calls, own time, cumulative time, callers)
+    lines.append("流水线阶段 (累计时间):")
+    for file_name, function in STAGE_FUNCTIONS:
+        calls = cumulative = 0
+        for (path, _, func), (_, nc, _, ct, _) in stats.stats.items():
+            if func == function and os.path.basename(path) == file_name:
+                calls += nc
+                cumulative += ct
+        if calls:
+            lines.append(f"  {file_name + ':' + function:<36} {cumulative:9.3f}s  {calls}次")
+
+    lines.append(f"耗时最多的函数 (自身时间前{top}):")
+    heaviest = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    for (path, line, func), (_, nc, tt, ct, _) in heaviest:
+        lines.append(f"  {tt:9.3f}s  累计{ct:9.3f}s  {nc:>8}次  {os.path.basename(path)}:{line}({func})")
+
+    lines.append(f"运行期间新增内存最多的位置 (前{top}, 峰值{peak / 1024 / 1024:.1f} MB):")
+    for stat in allocations[:top]:
+        frame = stat.traceback[0]
+        lines.append(
+            f"  {stat.size_diff / 1024:+10.1f} KB  {stat.count_diff:+8}块  "
+            f"{os.path.basename(frame.filename)}:{frame.lineno}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,325 @@
+import time
+import random
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterable, Iterator, Tuple, Type, TypeVar
+
+from mapping import mapping
+import metrics
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the backend while its circuit breaker is open."""
+    pass
+
+
+class RunBudgetExceeded(RuntimeError):
+    """Raised when the overall run time budget is used up."""
+    pass
+
+
+def error_code(e: BaseException) -> str | None:
+    """Return the backend error code (DingTalk/Tea `code` or oapi errcode), if any."""
+    code = getattr(e, "code", None)
+    return str(code) if code not in (None, "") else None
+
+
+def error_status(e: BaseException) -> int | None:
+    """Return the HTTP status carried by the exception, if any."""
+    status = getattr(e, "status_code", None) or getattr(e, "statusCode", None)
+    response = getattr(e, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def describe_error(e: BaseException) -> str:
+    """Readable "code: message" for any exception, never raising AttributeError."""
+    code = error_code(e)
+    message = getattr(e, "message", None) or str(e) or type(e).__name__
+    return f"{code}: {message}" if code else str(message)
+
+
+def retry_after(e: BaseException) -> float | None:
+    """Seconds the server asked us to wait (Retry-After), if provided."""
+    value = getattr(e, "retry_after", None)
+    response = getattr(e, "response", None)
+    if value is None and response is not None:
+        value = getattr(response, "headers", {}).get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_throttled(e: BaseException) -> bool:
+    """True for DingTalk rate-limit errors (throttling codes or HTTP 429)."""
+    code = error_code(e)
+    if code and (code in mapping.dingtalk_throttle_codes or "QpsLimit" in code):
+        return True
+    return error_status(e) == 429
+
+
+def is_auth_error(e: BaseException) -> bool:
+    """True if DingTalk rejected the access_token (HTTP 401 or an auth error code)."""
+    return error_code(e) in mapping.dingtalk_auth_error_codes or error_status(e) == 401
+
+
+def is_retryable(e: BaseException) -> bool:
+    """
+    Throttling, transient backend codes (e.g. oapi errcode -1), 5xx and
+    transport failures are retried and count toward the circuit breaker.
+    Any other error code or 4xx is an answer about this request (e.g. an
+    unknown userId, often sent with HTTP 200) and fails at once.
+    """
+    if isinstance(e, (CircuitOpenError, RunBudgetExceeded)):
+        return False
+    if is_throttled(e):
+        return True
+    status = error_status(e)
+    if status is not None and status >= 500:
+        return True
+    code = error_code(e)
+    if code is not None:
+        return code in mapping.dingtalk_transient_codes
+    return not (status is not None and 400 <= status < 500)
+
+
+def is_rejected(e: BaseException) -> bool:
+    """
+    True if the backend answered and refused this request (e.g. an unknown
+    userId). Throttling, 5xx, open circuits, an exhausted run budget and calls
+    that never got a response are not rejections.
+    """
+    answered = error_code(e) is not None or error_status(e) is not None
+    return answered and not is_retryable(e)
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with full jitter for the given 0-based attempt."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+class RetryPolicy:
+    """How often and how long to retry one kind of call."""
+
+    def __init__(
+        self,
+        attempts: int,
+        base_delay: float,
+        max_delay: float,
+        deadline: float | None = None,
+        retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+    ):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Per-call deadline across all attempts, in seconds
+        self.deadline = deadline
+        self.retry_on = retry_on
+
+
+class CircuitBreaker:
+    """
+    Fail fast while a backend is down.
+    Opens after `failure_threshold` consecutive failures, rejects calls for
+    `reset_timeout` seconds, then lets one trial call through (half-open).
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_running:
+                raise CircuitOpenError(f"{self.name}熔断中，暂停调用")
+            # Half-open: allow a single trial call
+            self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"{self.name}连续失败{self._failures}次，熔断{self.reset_timeout}秒")
+                self._opened_at = time.monotonic()
+
+
+class RunBudget:
+    """
+    Overall wall-clock budget shared by all retries of one run.
+    Tracked per thread, so each mailbox thread of the daemon runs under its
+    own budget; work handed to a thread pool takes the submitter's budget
+    along through bind().
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def start(self, seconds: float | None):
+        """Start the budget of the calling thread's run."""
+        self._local.deadline = time.monotonic() + seconds if seconds else None
+
+    def remaining(self) -> float | None:
+        deadline = getattr(self._local, "deadline", None)
+        if deadline is None or getattr(self._local, "exempt", False):
+            return None
+        return deadline - time.monotonic()
+
+    @contextmanager
+    def exempt(self):
+        """Lift the budget for calls made by the current thread only (e.g. error reports)."""
+        previous = getattr(self._local, "exempt", False)
+        self._local.exempt = True
+        try:
+            yield
+        finally:
+            self._local.exempt = previous
+
+    def bind(self, fn: Callable[..., T]) -> Callable[..., T]:
+        """Wrap fn to run on another thread under the calling thread's budget (and exemption)."""
+        deadline = getattr(self._local, "deadline", None)
+        exempt = getattr(self._local, "exempt", False)
+
+        @wraps(fn)
+        def bound(*args, **kwargs):
+            previous = getattr(self._local, "deadline", None), getattr(self._local, "exempt", False)
+            self._local.deadline, self._local.exempt = deadline, exempt
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._local.deadline, self._local.exempt = previous
+        return bound
+
+
+run_budget = RunBudget()
+
+
+class _Attempts:
+    """Attempt bookkeeping of one call() or call_stream() under a retry policy."""
+
+    def __init__(self, policy: RetryPolicy, breaker: CircuitBreaker | None, name: str, start_now: bool = True):
+        self.policy = policy
+        self.breaker = breaker
+        self.name = name
+        # Start of the per-call deadline; a stream starts it at its first failure
+        self.started: float | None = time.monotonic() if start_now else None
+        self.attempt = 0
+
+    def before(self):
+        """Check the run budget and the circuit breaker before an attempt."""
+        remaining = run_budget.remaining()
+        if remaining is not None and remaining <= 0:
+            raise RunBudgetExceeded(f"运行时间预算已用完，放弃调用{self.name}")
+        if self.breaker is not None:
+            self.breaker.before_call()
+
+    def succeeded(self):
+        if self.breaker is not None:
+            self.breaker.record_success()
+
+    def failed(self, e: BaseException):
+        """Record a failed attempt and wait before the next one; re-raise e if there is none."""
+        retryable = is_retryable(e)
+        if self.breaker is not None and retryable:
+            self.breaker.record_failure()
+        elif self.breaker is not None:
+            # The backend answered; a client error says nothing about its health
+            self.breaker.record_success()
+
+        self.attempt += 1
+        if not retryable or self.attempt >= self.policy.attempts:
+            raise e
+        if self.started is None:
+            self.started = time.monotonic()
+
+        delay = retry_after(e) if is_throttled(e) else None
+        if delay is None:
+            delay = backoff_delay(self.attempt - 1, self.policy.base_delay, self.policy.max_delay)
+        # Never sleep past the per-call deadline or the run budget
+        limits = []
+        if self.policy.deadline is not None:
+            limits.append(self.policy.deadline - (time.monotonic() - self.started))
+        if run_budget.remaining() is not None:
+            limits.append(run_budget.remaining())
+        if limits and delay >= min(limits):
+            raise e
+        metrics.inc("eco_retries_total", call=self.name)
+        print(f"调用{self.name}失败, {describe_error(e)}，等待{delay:.2f}秒后重试")
+        time.sleep(delay)
+
+
+def call(
+    fn: Callable[..., T],
+    *args,
+    policy: RetryPolicy,
+    breaker: CircuitBreaker | None = None,
+    name: str = "",
+    **kwargs,
+) -> T:
+    """
+    Call fn(*args, **kwargs) under the retry policy.
+    Honours throttling (Retry-After or backoff), the per-call deadline, the
+    run budget and the circuit breaker. Re-raises the last error.
+    """
+    attempts = _Attempts(policy, breaker, name or getattr(fn, "__name__", "call"))
+    while True:
+        attempts.before()
+        try:
+            result = fn(*args, **kwargs)
+        except policy.retry_on as e:
+            attempts.failed(e)
+            continue
+        attempts.succeeded()
+        return result
+
+
+def call_stream(
+    fn: Callable[..., Iterable[T]],
+    *args,
+    policy: RetryPolicy,
+    breaker: CircuitBreaker | None = None,
+    name: str = "",
+    **kwargs,
+) -> Iterator[T]:
+    """
+    Streaming counterpart of call(): yield from fn(*args, **kwargs) and start
+    a new iteration under the same policy, run budget and breaker when it
+    fails. A new iteration starts from scratch, so fn must skip items it
+    already yielded. The per-call deadline runs from the first failure since
+    the last item, so time the consumer spends on items never counts.
+    """
+    attempts = _Attempts(policy, breaker, name or getattr(fn, "__name__", "call"), start_now=False)
+    while True:
+        attempts.before()
+        try:
+            for item in fn(*args, **kwargs):
+                yield item
+                # Progress: a later failure gets a fresh deadline
+                attempts.started = None
+        except policy.retry_on as e:
+            attempts.failed(e)
+            continue
+        attempts.succeeded()
+        return
@@ -1,12 +1,18 @@
 import os
+import re
 import sys
 import json
-from typing import Dict
+import threading
+from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
+from typing import Dict, Iterable, List, Tuple
 from mapping import mapping
+import metrics
 
 def fn_relative(fn=None, sub_folder=None):
     """Get file path relative to this script."""
     if fn and os.path.isabs(fn):
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
         return fn
     else:
         if getattr(sys, 'frozen', False):
@@ -35,20 +41,218 @@ def fn_relative(fn=None, sub_folder=None):
 
         return path
 
-def save_json(data: Dict):
-    """Save processed message state."""
-    fp = fn_relative(mapping.json_fn)
-    with open(fp, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def normalize_message_id(message_id: str) -> str:
+    """Message-ID as stored and looked up: header folding removed, surrounding whitespace stripped."""
+    return re.sub(r"\r?\n(?=[ \t])", "", message_id).strip()
 
-def load_json() -> Dict:
-    """Load processed message state, creating an empty file if missing or invalid."""
-    fp = fn_relative(mapping.json_fn)
+def write_json_atomic(fp: str, data: Dict, mode: int | None = None):
+    """
+    Write JSON to a temp file in the same folder and rename it into place.
+    With mode (e.g. 0o600 for secrets) the temp file is created with it, so
+    the content is never readable with wider permissions.
+    """
+    tmp = f"{fp}.tmp"
+    if mode is None:
+        f = open(tmp, "w", encoding="utf-8")
+    else:
+        # A leftover temp file would keep its old permissions
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        f = open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode), "w", encoding="utf-8")
+    with f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, fp)
+
+def retention_cutoff(cfg=mapping) -> datetime:
+    """Entries processed before this moment can no longer match the search window."""
+    return (
+        datetime.now()
+        - relativedelta(months=cfg.time_month_to_create_todo, days=cfg.time_days_to_create_todo)
+        - timedelta(days=cfg.mapping_search_window + 1 + cfg.state_retention_margin_days)
+    )
+
+def compact(data: Dict[str, str], cfg=mapping) -> Dict[str, str]:
+    """Drop entries older than the retention cutoff; unreadable times are kept."""
+    cutoff = retention_cutoff(cfg)
+    kept = {}
+    for message_id, processed_time in data.items():
+        try:
+            if datetime.strptime(processed_time, mapping.json_time_format) < cutoff:
+                continue
+        except (TypeError, ValueError):
+            pass
+        kept[message_id] = processed_time
+    return kept
+
+def append_journal(message_id: str, processed_time: str, cfg=mapping):
+    """Append one processed Message-ID to the journal."""
+    fp = fn_relative(cfg.json_journal_fn)
+    line = json.dumps({"id": message_id, "time": processed_time}, ensure_ascii=False)
+    with open(fp, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def load_journal(cfg=mapping) -> Tuple[Dict[str, str], int]:
+    """Replay the journal and return (entries, line count); torn or corrupt lines are skipped."""
+    fp = fn_relative(cfg.json_journal_fn)
+    data = {}
+    lines = 0
+    try:
+        with open(fp, "r", encoding="utf-8") as f:
+            for line in f:
+                lines += 1
+                try:
+                    entry = json.loads(line)
+                    data[entry["id"]] = entry["time"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return data, lines
+
+def save_journal(data: Dict[str, str], cfg=mapping):
+    """Atomically rewrite the journal with the given (compacted) entries."""
+    fp = fn_relative(cfg.json_journal_fn)
+    tmp = f"{fp}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for message_id, processed_time in data.items():
+            f.write(json.dumps({"id": message_id, "time": processed_time}, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, fp)
+
+def save_json(data: Dict, cfg=mapping):
+    """Save processed message snapshot atomically."""
+    fp = fn_relative(cfg.json_fn)
+    write_json_atomic(fp, data)
+
+def load_json(cfg=mapping) -> Dict:
+    """
+    Load processed message state: snapshot plus journal.
+    A corrupt snapshot is moved aside and the state is recovered from the
+    journal instead of being reset.
+    """
+    data_loaded, _ = load_state(cfg)
+    return data_loaded
+
+@metrics.timed("state_load")
+def load_state(cfg=mapping) -> Tuple[Dict[str, str], int]:
+    """Load snapshot plus journal; return (compacted entries, journal line count)."""
+    fp = fn_relative(cfg.json_fn)
+    data_loaded = {}
+    try:
+        with open(fp, "r", encoding="utf-8") as f:
+            data_loaded = json.load(f)
+        if not isinstance(data_loaded, dict):
+            raise ValueError("snapshot is not a JSON object")
+    except FileNotFoundError:
+        data_loaded = {}
+    except (OSError, ValueError) as e:
+        print(f"状态文件损坏，从日志恢复: {str(e)}")
+        data_loaded = {}
+        try:
+            os.replace(fp, f"{fp}.corrupt")
+        except OSError:
+            pass
+
+    journal, journal_lines = load_journal(cfg)
+    data_loaded.update(journal)
+    # Entries written before IDs were normalized may carry a leading space
+    data_loaded = {normalize_message_id(k): v for k, v in data_loaded.items()}
+    return compact(data_loaded, cfg), journal_lines
+
+class ProcessedStore:
+    """
+    Processed Message-IDs loaded once per run and indexed in memory.
+    Shared by mailparser.mail_filter and main.py through processed_store().
+    """
+
+    def __init__(self, data: Dict[str, str] | None = None, journal_lines: int = 0, cfg=mapping):
+        self._data: Dict[str, str] = dict(data or {})
+        # Settings whose json_fn/json_journal_fn this store writes to
+        self._cfg = cfg
+        # Journal lines on disk, used to decide when to compact it
+        self._journal_lines = journal_lines
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def is_processed(self, message_id: str) -> bool:
+        """Return True if a TODO was already created for this Message-ID."""
+        return message_id in self._data
+
+    def new_ids(self, message_ids: Iterable[str]) -> List[str]:
+        """Return the Message-IDs not processed yet, in input order without duplicates."""
+        seen = set()
+        result = []
+        for message_id in message_ids:
+            if message_id in self._data or message_id in seen:
+                continue
+            seen.add(message_id)
+            result.append(message_id)
+        return result
+
+    def add(self, message_id: str, processed_time: str | None = None):
+        """Mark a Message-ID as processed (defaults to now) and journal it immediately."""
+        if processed_time is None:
+            processed_time = datetime.now().strftime(mapping.json_time_format)
+        self._data[message_id] = processed_time
+        append_journal(message_id, processed_time, self._cfg)
+        self._journal_lines += 1
+
+    def to_dict(self) -> Dict[str, str]:
+        return dict(self._data)
+
+    @metrics.timed("state_save")
+    def save(self):
+        """Drop expired entries, write the snapshot and compact the journal when needed."""
+        self._data = compact(self._data, self._cfg)
+        save_json(data=self._data, cfg=self._cfg)
+        # Rewrite the journal when it lags the snapshot (e.g. first run after
+        # upgrading) or has grown well beyond it
+        if (
+            self._journal_lines < len(self._data)
+            or self._journal_lines > len(self._data) + self._cfg.state_journal_slack
+        ):
+            save_journal(self._data, self._cfg)
+            self._journal_lines = len(self._data)
+
+# One store per state shard (snapshot path), shared by all threads of the process
+_processed_stores: Dict[str, ProcessedStore] = {}
+_processed_stores_lock = threading.Lock()
+
+def processed_store(cfg=mapping) -> ProcessedStore:
+    """Return the store of cfg's state shard, loading processed_messages.json on first use."""
+    key = fn_relative(cfg.json_fn)
+    with _processed_stores_lock:
+        store = _processed_stores.get(key)
+        if store is None:
+            data, journal_lines = load_state(cfg)
+            store = _processed_stores[key] = ProcessedStore(data, journal_lines=journal_lines, cfg=cfg)
+        return store
+
+def save_checkpoint(data: Dict, cfg=mapping):
+    """Save IMAP sync checkpoint (UIDVALIDITY and highest seen UID)."""
+    fp = fn_relative(cfg.imap_checkpoint_fn)
+    write_json_atomic(fp, data)
+
+def load_checkpoint(cfg=mapping) -> Dict:
+    """Load IMAP sync checkpoint; an empty dict forces a date-window scan."""
+    fp = fn_relative(cfg.imap_checkpoint_fn)
     try:
         with open(fp, "r", encoding="utf-8") as f:
             data_loaded = json.load(f)
-    except:
-        save_json(data={})
+    except (OSError, ValueError):
         data_loaded = {}
 
+    if not isinstance(data_loaded, dict):
+        return {}
     return data_loaded
@@ -0,0 +1,61 @@
+import re
+import unittest
+
+from eco_fields import FieldExtractor, FieldSpec, default_field_specs
+
+LABELS = ["ecn编码", "ecn名称", "产品名称", "工作负责人"]
+
+
+def per_field_search(specs, content):
+    """The extraction FieldExtractor replaced: one re.search per field."""
+    result = {}
+    for spec in specs:
+        match = re.search(rf"{re.escape(spec.label)}[:：]\s*({spec.pattern})", content)
+        if match:
+            result[spec.label] = match.group(1).strip()
+    return result
+
+
+class FieldExtractorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.specs = default_field_specs(LABELS)
+        self.extractor = FieldExtractor(self.specs)
+
+    def assert_same_as_per_field(self, content):
+        self.assertEqual(self.extractor.extract(content), per_field_search(self.specs, content))
+
+    def test_one_field_per_line(self):
+        self.assert_same_as_per_field("ecn编码：ECN001\necn名称：变更A\n产品名称：网关\n工作负责人：张三\n")
+
+    def test_label_inside_earlier_value(self):
+        content = "ecn名称：变更A 产品名称：网关"
+        self.assert_same_as_per_field(content)
+        self.assertEqual(self.extractor.extract(content)["产品名称"], "网关")
+
+    def test_first_match_wins_when_label_repeats_in_value(self):
+        content = "产品名称：见ecn名称：X\necn名称：Y"
+        self.assert_same_as_per_field(content)
+        self.assertEqual(self.extractor.extract(content)["ecn名称"], "X")
+
+    def test_missing_and_repeated_fields(self):
+        self.assert_same_as_per_field("说明\necn编码: A1 B2\necn编码：C3\n工作负责人:李四")
+
+    def test_required_field_found_inside_value(self):
+        specs = [FieldSpec("ecn名称", r"[^\n]+"), FieldSpec("产品名称", r"[^\n]+", required=True)]
+        extractor = FieldExtractor(specs)
+        self.assertEqual(extractor.missing_required(extractor.extract("ecn名称：变更A 产品名称：网关")), [])
+
+    def test_label_ending_another_label(self):
+        specs = default_field_specs(["ecn名称", "名称"])
+        content = "ecn名称：变更A\n名称：B"
+        self.assertEqual(FieldExtractor(specs).extract(content), per_field_search(specs, content))
+
+    def test_value_pattern_failing_at_first_label(self):
+        specs = [FieldSpec("ecn编码", r"ECN\d+")]
+        content = "ecn编码：待定\necn编码：ECN042"
+        self.assertEqual(FieldExtractor(specs).extract(content), per_field_search(specs, content))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+import htmltext
+from eco_fields import FieldExtractor, default_field_specs
+
+LABELS = ["ecn编码", "ecn名称", "产品名称", "工作负责人"]
+
+
+def table(*rows):
+    return "<table>" + "".join(f"<tr><td>{label}：</td><td>{value}</td></tr>" for label, value in rows) + "</table>"
+
+
+CASES = {
+    "plain_table": table(("ecn编码", "ECN001"), ("ecn名称", "变更A"), ("产品名称", "网关"), ("工作负责人", "张三")),
+    "br_in_cell": table(("ecn编码", "ECN001"), ("产品名称", "网关<br>V2"), ("工作负责人", "张三<br/>李四")),
+    "nested_markup": table(
+        ("ecn编码", "<b>ECN001</b>"),
+        ("ecn名称", "<span>变更<i>A</i></span>"),
+        ("产品名称", "<div><p>网关</p><p>V2</p></div>"),
+    ),
+    "label_with_markup": "<table><tr><td><b>ecn编码：</b></td><td>ECN001</td></tr></table>",
+    "label_and_value_in_one_cell": "<table><tr><td>ecn编码：ECN001<br>备注</td><td>产品名称：<b>网关</b></td></tr></table>",
+    "paragraph_after_table": table(("ecn编码", "ECN001"), ("ecn名称", "变更A")) + "<p>工作负责人：张三</p>",
+    "paragraph_before_table": "<p>产品名称：网关</p>" + table(("ecn编码", "ECN001")),
+    "no_table": "<div>ecn编码：ECN001</div><div>ecn名称：变更A</div><p>工作负责人：<b>张三</b></p>",
+    "skipped_tags": "<style>td {}</style>" + table(("ecn编码", "ECN001<script>x()</script>")),
+    "entities": table(("ecn名称", "变更 &amp; 归档"), ("产品名称", "&lt;网关&gt;")),
+}
+
+
+class HtmlBackendParityTest(unittest.TestCase):
+    """Every backend must extract the same fields as BeautifulSoup."""
+
+    def setUp(self):
+        self.extractor = FieldExtractor(default_field_specs(LABELS))
+
+    def fields(self, backend, html):
+        return self.extractor.extract(htmltext.BACKENDS[backend](html, LABELS))
+
+    def test_backends_match_bs4(self):
+        for backend in htmltext.BACKENDS:
+            if backend == "lxml":
+                try:
+                    import lxml.html  # noqa: F401
+                except ImportError:
+                    continue
+            for name, html in CASES.items():
+                with self.subTest(backend=backend, case=name):
+                    self.assertEqual(self.fields(backend, html), self.fields("bs4", html))
+
+    def test_table_keeps_first_line_of_cell(self):
+        self.assertEqual(self.fields("table", CASES["br_in_cell"])["产品名称"], "网关")
+
+    def test_table_finds_labels_outside_table(self):
+        self.assertEqual(self.fields("table", CASES["paragraph_after_table"])["工作负责人"], "张三")
+
+
+if __name__ == "__main__":
+    unittest.main()
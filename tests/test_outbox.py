@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import outbox
+import retry
+from dingtalk import DingTalkAPIError
+from mapping import mapping
+
+
+class OutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.box = outbox.Outbox(os.path.join(self.tmp.name, "outbox.sqlite3"))
+
+    def tearDown(self):
+        self.box.close()
+        self.tmp.cleanup()
+
+    def enqueue(self, message_id, user_ids=("u1", "u2")):
+        self.box.enqueue(message_id, list(user_ids), "subject", "description", 0)
+
+    def unsent_keys(self, message_ids=None):
+        return [(item.message_id, item.user_id) for item in self.box.unsent(message_ids)]
+
+    def test_unsent_skips_sent_rows(self):
+        self.enqueue("<a>")
+        self.enqueue("<b>")
+        first = self.box.unsent(["<a>"])[0]
+        self.box.mark_sent(first)
+        self.assertEqual(self.unsent_keys(), [("<a>", "u2"), ("<b>", "u1"), ("<b>", "u2")])
+        self.assertEqual(self.unsent_keys(["<a>"]), [("<a>", "u2")])
+        self.assertEqual(self.unsent_keys([]), [])
+
+    def test_enqueue_again_keeps_sent_rows(self):
+        self.enqueue("<a>")
+        for item in self.box.unsent():
+            self.box.mark_sent(item)
+        self.enqueue("<a>", ("u1", "u2", "u3"))
+        self.assertEqual(self.unsent_keys(), [("<a>", "u3")])
+
+    def test_failed_rows_are_resumed(self):
+        self.enqueue("<a>")
+        for item in self.box.unsent():
+            self.box.mark_failed(item, "boom")
+        resumed = self.box.unsent()
+        self.assertEqual([(item.user_id, item.attempts) for item in resumed], [("u1", 1), ("u2", 1)])
+
+    def test_uncounted_failure_never_gives_up(self):
+        self.enqueue("<a>", ["u1"])
+        with mock.patch.object(mapping, "outbox_max_attempts", 2):
+            for _ in range(5):
+                item = self.box.unsent()[0]
+                self.assertFalse(self.box.mark_failed(item, "down", counted=False))
+            item = self.box.unsent()[0]
+            self.assertEqual(item.attempts, 0)
+            self.assertFalse(self.box.mark_failed(item, "refused"))
+            self.assertTrue(self.box.mark_failed(self.box.unsent()[0], "refused"))
+        self.assertEqual(self.box.unsent(), [])
+
+    def test_is_done(self):
+        self.enqueue("<a>")
+        self.assertFalse(self.box.is_done("<a>"))
+        items = self.box.unsent()
+        self.box.mark_sent(items[0])
+        self.box.mark_failed(items[1], "boom")
+        self.assertFalse(self.box.is_done("<a>"))
+        self.box.mark_sent(self.box.unsent()[0])
+        self.assertTrue(self.box.is_done("<a>"))
+
+
+class SendOutboxTest(unittest.TestCase):
+    """main.send_outbox: only refusals by DingTalk count toward outbox_max_attempts."""
+
+    def setUp(self):
+        import main
+        self.main = main
+        self.tmp = tempfile.TemporaryDirectory()
+        self.box = outbox.Outbox(os.path.join(self.tmp.name, "outbox.sqlite3"))
+        self.box.enqueue("<a>", ["u1", "u2", "u3"], "subject", "description", 0)
+
+    def tearDown(self):
+        self.box.close()
+        self.tmp.cleanup()
+        # Drop the credentials the lazy settings cached from the patched environment
+        for name in ("client_id", "client_secret"):
+            if name in vars(mapping):
+                delattr(mapping, name)
+
+    def test_counts_only_refusals(self):
+        errors = [
+            None,
+            DingTalkAPIError("找不到该用户", code="60121"),
+            retry.CircuitOpenError("熔断中"),
+        ]
+        items = self.box.unsent()
+        with mock.patch.dict(os.environ, DINGTALK_CLIENT_ID="c", DINGTALK_CLIENT_SECRET="s"), \
+                mock.patch.object(self.main.dingtalk, "dispatch_todos", return_value=enumerate(errors)):
+            failures = []
+            self.assertEqual(self.main.send_outbox(self.box, items, mapping, failures), 0)
+        self.assertEqual(len(failures), 2)
+        self.assertEqual([(item.user_id, item.attempts) for item in self.box.unsent()], [("u2", 1), ("u3", 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
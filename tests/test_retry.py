@@ -0,0 +1,61 @@
+import time
+import unittest
+from unittest import mock
+
+import retry
+
+
+class DroppingStream:
+    """Yields 0..n-1, dropping the connection (OSError) once before each item in drops."""
+
+    def __init__(self, n, drops):
+        self.n = n
+        self.drops = set(drops)
+        self.sessions = 0
+
+    def __call__(self, done):
+        self.sessions += 1
+        for i in range(self.n):
+            if i in done:
+                continue
+            if i in self.drops:
+                self.drops.discard(i)
+                raise OSError("connection reset")
+            yield i
+
+
+def consume(policy, stream, pause=0.0):
+    done = []
+    for item in retry.call_stream(stream, done, policy=policy, name="test"):
+        done.append(item)
+        time.sleep(pause)
+    return done
+
+
+class CallStreamTest(unittest.TestCase):
+
+    def test_late_drop_reconnects_after_slow_consumer(self):
+        # The consumer alone takes longer than the deadline; only retrying time counts
+        policy = retry.RetryPolicy(attempts=3, base_delay=0.01, max_delay=0.01, deadline=0.5)
+        stream = DroppingStream(3, drops=[2])
+        self.assertEqual(consume(policy, stream, pause=0.3), [0, 1, 2])
+        self.assertEqual(stream.sessions, 2)
+
+    def test_deadline_still_bounds_retries(self):
+        policy = retry.RetryPolicy(attempts=5, base_delay=0.2, max_delay=0.2, deadline=0.1)
+        stream = DroppingStream(3, drops=[0, 1])
+        # The backoff (0.2s) would end past the deadline, so the first failure is final
+        with mock.patch.object(retry, "backoff_delay", return_value=0.2), self.assertRaises(OSError):
+            consume(policy, stream)
+        self.assertEqual(stream.sessions, 1)
+
+    def test_attempts_exhausted(self):
+        policy = retry.RetryPolicy(attempts=2, base_delay=0.01, max_delay=0.01)
+        stream = DroppingStream(3, drops=[0, 1])
+        with self.assertRaises(OSError):
+            consume(policy, stream)
+        self.assertEqual(stream.sessions, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import state
+from mapping import mapping
+
+
+def stamp(days_ago: float) -> str:
+    return (datetime.now() - timedelta(days=days_ago)).strftime(mapping.json_time_format)
+
+
+class StateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cfg = SimpleNamespace(
+            json_fn=os.path.join(self.tmp.name, "processed_messages.json"),
+            json_journal_fn=os.path.join(self.tmp.name, "processed_messages.journal"),
+            time_month_to_create_todo=0,
+            time_days_to_create_todo=0,
+            mapping_search_window=10,
+            state_retention_margin_days=30,
+            state_journal_slack=5,
+        )
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_snapshot(self, content: str):
+        with open(self.cfg.json_fn, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def write_journal(self, lines):
+        with open(self.cfg.json_journal_fn, "w", encoding="utf-8") as f:
+            f.writelines(line + "\n" for line in lines)
+
+    def journal_entry(self, message_id: str, processed_time: str) -> str:
+        return json.dumps({"id": message_id, "time": processed_time}, ensure_ascii=False)
+
+    def journal_lines(self):
+        with open(self.cfg.json_journal_fn, "r", encoding="utf-8") as f:
+            return f.read().splitlines()
+
+    def test_corrupt_snapshot_recovered_from_journal(self):
+        now = stamp(0)
+        self.write_snapshot('{"<a>": "' + now + '", "<b>"')
+        self.write_journal([self.journal_entry("<a>", now), self.journal_entry("<b>", now)])
+        data, lines = state.load_state(self.cfg)
+        self.assertEqual(data, {"<a>": now, "<b>": now})
+        self.assertEqual(lines, 2)
+        self.assertFalse(os.path.exists(self.cfg.json_fn))
+        self.assertTrue(os.path.exists(f"{self.cfg.json_fn}.corrupt"))
+
+    def test_torn_last_journal_line_is_skipped(self):
+        now = stamp(0)
+        self.write_snapshot(json.dumps({"<a>": now}))
+        with open(self.cfg.json_journal_fn, "w", encoding="utf-8") as f:
+            f.write(self.journal_entry("<b>", now) + "\n" + '{"id": "<c>", "ti')
+        data, lines = state.load_state(self.cfg)
+        self.assertEqual(data, {"<a>": now, "<b>": now})
+        self.assertEqual(lines, 2)
+
+    def test_entries_before_retention_cutoff_are_dropped(self):
+        keep_days = self.cfg.mapping_search_window + 1 + self.cfg.state_retention_margin_days
+        self.write_snapshot(json.dumps({"<old>": stamp(keep_days + 1), "<odd>": "not a time"}))
+        self.write_journal([self.journal_entry("<recent>", stamp(keep_days - 1))])
+        data, _ = state.load_state(self.cfg)
+        self.assertEqual(sorted(data), ["<odd>", "<recent>"])
+
+    def test_journal_rewritten_when_shorter_than_snapshot(self):
+        now = stamp(0)
+        self.write_snapshot(json.dumps({"<a>": now, "<b>": now, "<c>": now}))
+        self.write_journal([self.journal_entry("<a>", now)])
+        data, lines = state.load_state(self.cfg)
+        store = state.ProcessedStore(data, journal_lines=lines, cfg=self.cfg)
+        store.save()
+        self.assertEqual(len(self.journal_lines()), 3)
+        # The rewritten journal alone restores every entry
+        os.remove(self.cfg.json_fn)
+        self.assertEqual(state.load_state(self.cfg)[0], {"<a>": now, "<b>": now, "<c>": now})
+
+    def test_journal_rewritten_only_beyond_slack(self):
+        store = state.ProcessedStore(cfg=self.cfg)
+        for index in range(3):
+            store.add(f"<{index}>")
+        # Re-adding an ID journals another line without growing the data
+        for _ in range(self.cfg.state_journal_slack):
+            store.add("<0>")
+        store.save()
+        self.assertEqual(len(self.journal_lines()), 3 + self.cfg.state_journal_slack)
+        store.add("<0>")
+        store.save()
+        self.assertEqual(len(self.journal_lines()), 3)
+
+    def test_added_ids_survive_without_save(self):
+        store = state.ProcessedStore(cfg=self.cfg)
+        store.add("<a>")
+        data, lines = state.load_state(self.cfg)
+        self.assertIn("<a>", data)
+        self.assertEqual(lines, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()